@@ -4,13 +4,26 @@ __all__ = ["index", "modules", "custom_doc_links", "git_url"]
 
 index = {"TemporalModelBase": "00_model.ipynb",
          "TemporalModel": "00_model.ipynb",
+         "TemporalModelOptimized1f": "00_model.ipynb",
+         "StreamingTemporalModel": "00_model.ipynb",
+         "infer_windowed": "00_model.ipynb",
          "mpjpe": "01_loss.ipynb",
          "p_mpjpe": "01_loss.ipynb",
          "mean_velocity_error": "01_loss.ipynb",
          "weighted_mpjpe": "01_loss.ipynb",
          "n_mpjpe": "01_loss.ipynb",
+         "procrustes_align": "01_loss.ipynb",
+         "p_mpjpe_torch": "01_loss.ipynb",
+         "p_mpjpe_fast": "01_loss.ipynb",
+         "scale_align": "01_loss.ipynb",
+         "mean_velocity_error_torch": "01_loss.ipynb",
+         "ErrorAccumulator": "01_loss.ipynb",
          "Skeleton": "02_skeleton.ipynb",
          "MocapDataset": "03_mocap_dataset.ipynb",
+         "ActionData": "03_mocap_dataset.ipynb",
+         "dataset_source": "03_mocap_dataset.ipynb",
+         "load_dataset": "03_mocap_dataset.ipynb",
+         "convert_dataset": "03_mocap_dataset.ipynb",
          "Human36mDataset": "04_h36m_dataset.ipynb",
          "h36m_skeleton": "04_h36m_dataset.ipynb",
          "h36m_cameras_intrinsic_params": "04_h36m_dataset.ipynb",
@@ -21,15 +34,27 @@ index = {"TemporalModelBase": "00_model.ipynb",
          "camera_to_world": "05_camera.ipynb",
          "project_to_2d": "05_camera.ipynb",
          "project_to_2d_linear": "05_camera.ipynb",
-         "world_to_camera_miqus": "21_prepare_data_3d.ipynb",
+         "world_to_camera_miqus": "05_camera.ipynb",
          "camera_to_world_miqus": "05_camera.ipynb",
          "project_point_radial": "05_camera.ipynb",
+         "stack_miqus_cameras": "05_camera.ipynb",
+         "cameras_to_torch": "05_camera.ipynb",
+         "world_to_cameras": "05_camera.ipynb",
+         "project_points_radial": "05_camera.ipynb",
+         "undistort_points": "05_camera.ipynb",
+         "UndistortionGrid": "05_camera.ipynb",
          "qrot": "06_quaternion.ipynb",
          "qinverse": "06_quaternion.ipynb",
+         "qmul": "06_quaternion.ipynb",
+         "qmatrix": "06_quaternion.ipynb",
          "wrap": "07_utils.ipynb",
          "deterministic_random": "07_utils.ipynb",
+         "hash_inputs": "07_utils.ipynb",
+         "save_array_tree": "07_utils.ipynb",
+         "load_array_tree": "07_utils.ipynb",
          "ChunkedGenerator": "08_generators.ipynb",
          "UnchunkedGenerator": "08_generators.ipynb",
+         "PrefetchGenerator": "08_generators.ipynb",
          "custom_camera_params": "09_custom_dataset.ipynb",
          "CustomDataset": "09_custom_dataset.ipynb",
          "get_resolution": "14_infer_video.ipynb",
@@ -44,8 +69,33 @@ index = {"TemporalModelBase": "00_model.ipynb",
          "h36m_metadata": "13_prepare_data_2d_custom.ipynb",
          "suggest_metadata": "13_prepare_data_2d_custom.ipynb",
          "output_prefix_2d": "13_prepare_data_2d_custom.ipynb",
+         "select_best_instances": "13_prepare_data_2d_custom.ipynb",
+         "interpolate_missing": "13_prepare_data_2d_custom.ipynb",
          "decode": "13_prepare_data_2d_custom.ipynb",
+         "decode_to_store": "13_prepare_data_2d_custom.ipynb",
          "main": "21_prepare_data_3d.ipynb",
+         "batched": "14_infer_video.ipynb",
+         "BatchPredictor": "14_infer_video.ipynb",
+         "RoiTracker": "14_infer_video.ipynb",
+         "to_full_frame": "14_infer_video.ipynb",
+         "KeyframePropagator": "14_infer_video.ipynb",
+         "MotionGate": "14_infer_video.ipynb",
+         "format_outputs": "14_infer_video.ipynb",
+         "PipelineStopped": "14_infer_video.ipynb",
+         "Stage": "14_infer_video.ipynb",
+         "read_stage": "14_infer_video.ipynb",
+         "detect_stage": "14_infer_video.ipynb",
+         "write_stage": "14_infer_video.ipynb",
+         "process_video": "14_infer_video.ipynb",
+         "utilisation_report": "14_infer_video.ipynb",
+         "file_hash": "14_infer_video.ipynb",
+         "save_atomic": "14_infer_video.ipynb",
+         "load_manifest": "14_infer_video.ipynb",
+         "save_manifest": "14_infer_video.ipynb",
+         "is_processed": "14_infer_video.ipynb",
+         "build_predictor": "14_infer_video.ipynb",
+         "init_worker": "14_infer_video.ipynb",
+         "process_worker": "14_infer_video.ipynb",
          "INFO": "15_prepare_data_COCO.ipynb",
          "LICENSES": "15_prepare_data_COCO.ipynb",
          "CATEGORIES": "15_prepare_data_COCO.ipynb",
@@ -57,6 +107,13 @@ index = {"TemporalModelBase": "00_model.ipynb",
          "binary_mask_to_polygon": "16_pycococreatortools.ipynb",
          "create_image_info": "16_pycococreatortools.ipynb",
          "create_annotation_info": "16_pycococreatortools.ipynb",
+         "qtm_unused_markers": "17_format_qtmdata.ipynb",
+         "qtm_midpoint_keypoints": "17_format_qtmdata.ipynb",
+         "keypoint_table": "17_format_qtmdata.ipynb",
+         "convert_qtmdata": "17_format_qtmdata.ipynb",
+         "output_name": "17_format_qtmdata.ipynb",
+         "convert_to_npy": "17_format_qtmdata.ipynb",
+         "convert_directory": "17_format_qtmdata.ipynb",
          "RunningposeDataset": "18_runningpose_dataset.ipynb",
          "runningpose_skeleton": "18_runningpose_dataset.ipynb",
          "runningpose_cameras_intrinsic_params": "18_runningpose_dataset.ipynb",
@@ -78,11 +135,12 @@ index = {"TemporalModelBase": "00_model.ipynb",
          "keypoints_3D": "20_transfer_model.ipynb",
          "joints_left": "20_transfer_model.ipynb",
          "joints_right": "20_transfer_model.ipynb",
-         "keypoints_2D": "20_transfer_model.ipynb",
+         "keypoints_2D_path": "20_transfer_model.ipynb",
          "keypoints_2D_metadata": "20_transfer_model.ipynb",
          "keypoints_2D_symmetry": "20_transfer_model.ipynb",
          "kps_left": "20_transfer_model.ipynb",
          "kps_right": "20_transfer_model.ipynb",
+         "keypoints_2D": "20_transfer_model.ipynb",
          "subjects": "20_transfer_model.ipynb",
          "subjects_extra_cut": "20_transfer_model.ipynb",
          "subjects_cut": "20_transfer_model.ipynb",
@@ -125,16 +183,25 @@ index = {"TemporalModelBase": "00_model.ipynb",
          "final_momentum": "20_transfer_model.ipynb",
          "valid_generator": "20_transfer_model.ipynb",
          "train_generator": "20_transfer_model.ipynb",
+         "train_prefetcher": "20_transfer_model.ipynb",
          "train_generator_eval": "20_transfer_model.ipynb",
          "epoch": "20_transfer_model.ipynb",
          "chk_path": "20_transfer_model.ipynb",
          "keypoints_3D_test": "20_transfer_model.ipynb",
+         "keypoints_2D_test_path": "20_transfer_model.ipynb",
          "keypoints_2D_test": "20_transfer_model.ipynb",
          "poses_2d_test": "20_transfer_model.ipynb",
          "poses_3d_test": "20_transfer_model.ipynb",
          "testing_generator": "20_transfer_model.ipynb",
          "losses_3d_test": "20_transfer_model.ipynb",
-         "convert_to_camera": "21_prepare_data_3d.ipynb"}
+         "stack_extrinsic_params": "21_prepare_data_3d.ipynb",
+         "load_world_keypoints": "21_prepare_data_3d.ipynb",
+         "convert_to_cameras": "21_prepare_data_3d.ipynb",
+         "convert_to_camera": "21_prepare_data_3d.ipynb",
+         "convert_file": "21_prepare_data_3d.ipynb",
+         "write_index": "21_prepare_data_3d.ipynb",
+         "load_custom_views": "22_triangulation.ipynb",
+         "triangulate_points": "22_triangulation.ipynb"}
 
 modules = ["core/model.py",
            "core/loss.py",
@@ -157,7 +224,8 @@ modules = ["core/model.py",
            "core/runningpose_dataset.py",
            "core/train_detectron2.py",
            "core/transfer_model.py",
-           "data/prepare_data_3d.py"]
+           "data/prepare_data_3d.py",
+           "core/triangulation.py"]
 
 doc_url = "https://pages.github.tifx04-22-10.com./runningpose/"
 
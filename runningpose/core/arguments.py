@@ -13,6 +13,9 @@ def parse_args():
     # General arguments
     parser.add_argument('-d', '--dataset', default='h36m', type=str, metavar='NAME', help='target dataset') # h36m or humaneva
     parser.add_argument('-k', '--keypoints', default='cpn_ft_h36m_dbb', type=str, metavar='NAME', help='2D detections to use')
+    parser.add_argument('--undistort', action='store_true', help='remove the lens distortion from the 2D detections')
+    parser.add_argument('--cache-dir', default='', type=str, metavar='PATH',
+                        help='directory to cache prepared data in, e.g. data/cache (default: no cache)')
     parser.add_argument('-str', '--subjects-train', default='S1,S5,S6,S7,S8', type=str, metavar='LIST',
                         help='training subjects separated by comma')
     parser.add_argument('-ste', '--subjects-test', default='S9,S11', type=str, metavar='LIST', help='test subjects separated by comma')
@@ -57,6 +60,15 @@ def parse_args():
     parser.add_argument('--no-bone-length', action='store_false', dest='bone_length_term',
                         help='disable bone length term in semi-supervised settings')
     parser.add_argument('--no-proj', action='store_true', help='disable projection for semi-supervised setting')
+    parser.add_argument('--workers', default=1, type=int, metavar='N',
+                        help='number of background workers preparing training batches (0 to disable)')
+    parser.add_argument('--prefetch', default=2, type=int, metavar='N', help='batches each worker prepares in advance')
+    parser.add_argument('--worker-processes', action='store_true', help='use worker processes instead of threads')
+    parser.add_argument('--eval-window', default=0, type=int, metavar='N',
+                        help='predict at most N frames per forward pass when evaluating (0 for whole sequences)')
+    parser.add_argument('--eval-workers', default=0, type=int, metavar='N', help='number of workers evaluating windows in parallel')
+    parser.add_argument('--eval-pack-frames', default=0, type=int, metavar='N',
+                        help='pack sequences into evaluation batches of up to N frames (0 for one sequence per batch)')
 
     # Visualization
     parser.add_argument('--viz-subject', type=str, metavar='STR', help='subject to render')
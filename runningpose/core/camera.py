@@ -1,14 +1,19 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/05_camera.ipynb (unless otherwise specified).
 
 __all__ = ['normalize_screen_coordinates', 'image_coordinates', 'world_to_camera', 'camera_to_world', 'project_to_2d',
-           'project_to_2d_linear', 'world_to_camera_miqus', 'camera_to_world_miqus', 'project_point_radial']
+           'project_to_2d_linear', 'world_to_camera_miqus', 'camera_to_world_miqus', 'project_point_radial',
+           'stack_miqus_cameras', 'cameras_to_torch', 'world_to_cameras', 'project_points_radial', 'undistort_points',
+           'UndistortionGrid']
 
 # Cell
+import hashlib
+import os
+import warnings
+
 import numpy as np
 import torch
 
-from .quaternion import qinverse, qrot
-from .utils import wrap
+from .quaternion import qmatrix
 
 # Cell
 def normalize_screen_coordinates(X, w, h):
@@ -33,9 +38,9 @@ def world_to_camera(X, R, t):
     Converts from world to camera coordinates with Human3.6M extrinsic
     camera parameters structure.
     """
-    Rt = wrap(qinverse, R) # Invert rotation
-    # Rotate and translate
-    return wrap(qrot, np.tile(Rt, (*X.shape[:-1], 1)), X - t)
+    # Translate and rotate by the inverse of R, for row vectors this
+    # is a product with the rotation matrix itself.
+    return (X - t) @ qmatrix(R)
 
 # Cell
 def camera_to_world(X, R, t):
@@ -44,7 +49,7 @@ def camera_to_world(X, R, t):
     camera parameters structure.
     """
     # Rotate and translate
-    return wrap(qrot, np.tile(R, (*X.shape[:-1], 1)), X) + t
+    return X @ qmatrix(R).swapaxes(-1, -2) + t
 
 # Cell
 def project_to_2d(X, camera_params):
@@ -161,29 +166,248 @@ def project_point_radial(P, R, T, f, c, k, p):
     p: 2x1 Camera tangential distortion coefficients
   Returns
     Proj: Nx2 points in pixel space
-    D: 1xN depth of each point in camera space
-    radial: 1xN radial distortion per point
-    tan: 1xN tangential distortion per point
-    r2: 1xN squared radius of the projected points before distortion
+    D: N depth of each point in camera space
+    radial: N radial distortion per point
+    tan: N tangential distortion per point
+    r2: N squared radius of the projected points before distortion
   """
 
   # P is a matrix of 3-dimensional points
   assert len(P.shape) == 2
   assert P.shape[1] == 3
 
-  N = P.shape[0]
-  X = R.dot(P.T - T) # rotate and translate
-  XX = X[:2,:] / X[2,:]
-  r2 = XX[0,:]**2 + XX[1,:]**2
+  camera = {
+    'R': R, 'T': np.reshape(T, 3), 'f': np.broadcast_to(np.reshape(f, -1), 2),
+    'c': np.reshape(c, 2), 'k': np.reshape(k, 3), 'p': np.reshape(p, 2),
+  }
+  camera = {key: np.asarray(value)[None] for key, value in camera.items()}
+  Proj, D, radial, tan, r2 = project_points_radial(P[None], camera)
+
+  return Proj[0], D[0], radial[0], tan[0], r2[0]
+
+# Cell
+def stack_miqus_cameras(intrinsic_params, extrinsic_params, subpixels=64):
+    """
+    Stacks Miqus calibrations, e.g. runningpose_cameras_intrinsic_params
+    and runningpose_cameras_extrinsic_params, into arrays with a leading
+    camera axis. The keys are the arguments of project_point_radial:
+
+    R -- (C, 3, 3) camera rotation matrices.
+    T -- (C, 3) camera translations.
+    f -- (C, 2) camera focal lengths in pixels.
+    c -- (C, 2) camera centers in pixels.
+    k -- (C, 3) camera radial distortion coefficients.
+    p -- (C, 2) camera tangential distortion coefficients.
+
+    QTM exports the focal lengths and centers in subpixels, 1/64 of a
+    pixel, so they are divided by subpixels. A center outside of the
+    image (res_w, res_h) is not a valid calibration, it is replaced by
+    the image center with a warning.
+    """
+    assert len(intrinsic_params) == len(extrinsic_params)
+    names = {
+        'R': 'rotation', 'T': 'translation', 'f': 'focal_length',
+        'c': 'center', 'k': 'radial_distortion', 'p': 'tangential_distortion',
+    }
+    cams = [
+        {**intrinsic, **extrinsic}
+        for intrinsic, extrinsic in zip(intrinsic_params, extrinsic_params)
+    ]
+    cameras = {
+        key: np.stack([np.asarray(cam[name], dtype='float64') for cam in cams])
+        for key, name in names.items()
+    }
+    cameras['f'] /= subpixels
+    cameras['c'] /= subpixels
+    for i, cam in enumerate(cams):
+        size = np.array([cam['res_w'], cam['res_h']], dtype='float64')
+        if not ((cameras['c'][i] >= 0) & (cameras['c'][i] <= size)).all():
+            warnings.warn('Center {} of camera {} is outside of the image, using the image center.'.format(
+                cameras['c'][i], cam.get('id', i)))
+            cameras['c'][i] = size / 2
+    return cameras
+
+def cameras_to_torch(cameras, device=None, dtype=torch.float32):
+    """Returns stacked camera parameters as tensors, for use in training."""
+    return {
+        key: torch.as_tensor(value, dtype=dtype, device=device)
+        for key, value in cameras.items()
+    }
+
+def world_to_cameras(P, cameras):
+    """
+    Converts points from world coordinates to the camera coordinates of
+    each camera, like world_to_camera_miqus for several cameras.
+
+    Arguments:
+    P -- (C, *, 3) points in world coordinates, or (1, *, 3) for the
+        same points in all cameras.
+    cameras -- Stacked camera parameters, see stack_miqus_cameras.
+
+    Returns (C, *, 3) points in camera coordinates.
+    """
+    assert P.shape[-1] == 3
+    assert len(P.shape) >= 3
+
+    R, T = cameras['R'], cameras['T']
+    R = R.reshape(R.shape[:1] + (1,)*(len(P.shape) - 3) + (3, 3))
+    T = T.reshape(T.shape[:1] + (1,)*(len(P.shape) - 2) + (3,))
+    return (P - T) @ R.swapaxes(-1, -2) # Rotate and translate.
+
+def project_points_radial(P, cameras):
+    """
+    Batched project_point_radial, projects points into several cameras
+    in one broadcasted pass. Works on NumPy arrays as well as on torch
+    tensors (see cameras_to_torch), so it is differentiable.
+
+    Arguments:
+    P -- (C, *, 3) points in world coordinates, e.g. (C, frames, joints, 3),
+        or (1, *, 3) to project the same points into all cameras.
+    cameras -- Stacked camera parameters, see stack_miqus_cameras.
+
+    Returns:
+    Proj -- (C, *, 2) points in pixel space.
+    D -- (C, *) depth of each point in camera space.
+    radial -- (C, *) radial distortion per point.
+    tan -- (C, *) tangential distortion per point.
+    r2 -- (C, *) squared radius of the projected points before distortion.
+    """
+    assert P.shape[-1] == 3
+    assert len(P.shape) >= 3
+
+    def expand(param):
+        # Broadcasts a (C, n) parameter over the point dimensions.
+        return param.reshape(
+            param.shape[:1] + (1,)*(len(P.shape) - 2) + param.shape[1:])
+
+    X = world_to_cameras(P, cameras)
+    XX = X[..., :2] / X[..., 2:]
+    r2 = XX[..., 0]**2 + XX[..., 1]**2
+
+    k = expand(cameras['k'])
+    p = expand(cameras['p'])
+    radial = 1 + k[..., 0]*r2 + k[..., 1]*r2**2 + k[..., 2]*r2**3
+    tan = p[..., 0]*XX[..., 1] + p[..., 1]*XX[..., 0]
+
+    XXX = XX*(radial + tan)[..., None] + p[..., [1, 0]]*r2[..., None]
+
+    Proj = expand(cameras['f'])*XXX + expand(cameras['c'])
+    return Proj, X[..., 2], radial, tan, r2
+
+# Cell
+def undistort_points(points, cameras, iterations=5):
+    """
+    Inverse of the distortion in project_points_radial, solved with a
+    fixed number of fixed-point iterations on all points at once.
 
-  radial = 1 + np.einsum('ij,kl->il', np.tile(k,(1, N)), np.array([r2, r2**2, r2**3]))
-  tan = p[0]*XX[1,:] + p[1]*XX[0,:]
+    Arguments:
+    points -- (C, *, 2) points in pixel space, one set per camera.
+    cameras -- Stacked camera parameters, see stack_miqus_cameras.
+    iterations -- Number of iterations, a few are enough for the
+        small distortion of the Miqus cameras.
 
-  XXX = XX * np.tile(radial+tan,(2,1)) + np.outer(np.array([p[1], p[0]]).reshape(-1), r2)
+    Returns (C, *, 2) undistorted normalized image coordinates, i.e.
+    x/z and y/z in camera coordinates.
+    """
+    assert points.shape[-1] == 2
+
+    def expand(param):
+        return param.reshape(
+            param.shape[:1] + (1,)*(len(points.shape) - 2) + param.shape[1:])
+
+    k = expand(cameras['k'])
+    p = expand(cameras['p'])
+    distorted = (points - expand(cameras['c'])) / expand(cameras['f'])
+    XX = distorted
+    for _ in range(iterations):
+        r2 = XX[..., 0]**2 + XX[..., 1]**2
+        radial = 1 + k[..., 0]*r2 + k[..., 1]*r2**2 + k[..., 2]*r2**3
+        tan = p[..., 0]*XX[..., 1] + p[..., 1]*XX[..., 0]
+        XX = (distorted - p[..., [1, 0]]*r2[..., None]) / (radial + tan)[..., None]
+    return XX
 
-  Proj = (f * XXX) + c
-  Proj = Proj.T
+# Cell
+class UndistortionGrid:
+    """
+    Precomputed undistort_points for one camera. Keypoint sequences of
+    any shape (*, 2) are undistorted at once by bilinear interpolation
+    in a grid over the image, instead of iterating for every point.
+    The grid is cached on disk, keyed by the calibration parameters.
 
-  D = X[2,]
+    Arguments:
+    camera -- Camera with center, focal_length, radial_distortion and
+        tangential_distortion, e.g. from MocapDataset.cameras().
+    bounds -- (x_min, y_min, x_max, y_max) of the image in the units of
+        the camera center, e.g. (0, 0, res_w, res_h) in pixels.
+    size -- Number of grid points along the width of the image.
+    cache_dir -- Directory of the cached grids, None to not cache them.
+    iterations -- Number of iterations of undistort_points for the grid.
+    """
 
-  return Proj, D, radial, tan, r2
\ No newline at end of file
+    def __init__(self, camera, bounds, size=256, cache_dir=None, iterations=20):
+        names = {
+            'f': 'focal_length', 'c': 'center',
+            'k': 'radial_distortion', 'p': 'tangential_distortion',
+        }
+        self.camera = {
+            key: np.asarray(camera[name], dtype='float64')[None]
+            for key, name in names.items()
+        }
+        self.bounds = np.asarray(bounds, dtype='float64')
+        self.size = size
+        self.iterations = iterations
+
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, 'undistortion_{}.npy'.format(self.key()))
+        if path is not None and os.path.exists(path):
+            self.grid = np.load(path)
+        else:
+            self.grid = self._build()
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.save(path, self.grid)
+
+    def key(self):
+        """Returns a hash of the calibration and the grid parameters."""
+        digest = hashlib.sha256()
+        for key in sorted(self.camera):
+            digest.update(self.camera[key].tobytes())
+        digest.update(self.bounds.tobytes())
+        digest.update(np.array([self.size, self.iterations]).tobytes())
+        return digest.hexdigest()[:16]
+
+    def step(self):
+        """Returns the distance between two grid points."""
+        return (self.bounds[2] - self.bounds[0]) / (self.size - 1)
+
+    def _build(self):
+        """Returns the undistorted points of the grid, (rows, size, 2)."""
+        x_min, y_min, x_max, y_max = self.bounds
+        rows = int(np.ceil((y_max - y_min) / self.step())) + 1
+        x = x_min + self.step()*np.arange(self.size)
+        y = y_min + self.step()*np.arange(rows)
+        points = np.stack(np.meshgrid(x, y), axis=-1)
+        XX = undistort_points(points[None], self.camera, self.iterations)[0]
+        return self.camera['f'][0]*XX + self.camera['c'][0]
+
+    def __call__(self, points):
+        """
+        Returns the undistorted points, in the units and dtype of points.
+        Points outside of the image are extrapolated from its border.
+        """
+        assert points.shape[-1] == 2
+
+        finite = np.isfinite(points).all(-1)
+        position = (np.where(finite[..., None], points, 0) - self.bounds[:2]) / self.step()
+        index = np.clip(
+            np.floor(position), 0, np.array(self.grid.shape[1::-1]) - 2).astype(int)
+        t = position - index
+        tx, ty = t[..., :1], t[..., 1:]
+        x, y = index[..., 0], index[..., 1]
+
+        top = self.grid[y, x]*(1 - tx) + self.grid[y, x + 1]*tx
+        bottom = self.grid[y + 1, x]*(1 - tx) + self.grid[y + 1, x + 1]*tx
+        undistorted = top*(1 - ty) + bottom*ty
+        undistorted[~finite] = np.nan
+        return undistorted.astype(points.dtype, copy=False)
\ No newline at end of file
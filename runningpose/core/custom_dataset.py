@@ -9,7 +9,7 @@ import numpy as np
 from .camera import (image_coordinates,
                                      normalize_screen_coordinates)
 from .h36m_dataset import h36m_skeleton
-from .mocap_dataset import MocapDataset
+from .mocap_dataset import MocapDataset, load_dataset
 from .skeleton import Skeleton
 
 # Cell
@@ -27,20 +27,19 @@ custom_camera_params = {
 # Cell
 class CustomDataset(MocapDataset):
     """Creates a custom dataset with the Human36m skeleton."""
-    def __init__(self, detections_path, remove_static_joints=True):
-        super().__init__(fps=None, skeleton=h36m_skeleton)
+    def __init__(self, detections_path, remove_static_joints=True, dtype='float32'):
+        super().__init__(fps=None, skeleton=h36m_skeleton, dtype=dtype)
         self._cameras = {}
         self._data = {}
 
         # Load serialized dataset
-        data = np.load(detections_path, allow_pickle=True)
-        resolutions = data['metadata'].item()['video_metadata']
+        resolutions = load_dataset(detections_path, 'metadata')['video_metadata']
 
         for video_name, res in resolutions.items():
             cam = {}
             cam.update(custom_camera_params)
-            cam['orientation'] = np.array(cam['orientation'], dtype='float32')
-            cam['translation'] = np.array(cam['translation'], dtype='float32')
+            cam['orientation'] = np.array(cam['orientation'], dtype=self._dtype)
+            cam['translation'] = np.array(cam['translation'], dtype=self._dtype)
             cam['translation'] = cam['translation']/1000 # mm to meters
 
             cam['id'] = video_name
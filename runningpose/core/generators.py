@@ -1,11 +1,54 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/08_generators.ipynb (unless otherwise specified).
 
-__all__ = ['ChunkedGenerator', 'UnchunkedGenerator']
+__all__ = ['ChunkedGenerator', 'UnchunkedGenerator', 'PrefetchGenerator']
 
 # Cell
+import copy
+import queue
+import threading
 from itertools import zip_longest
 
 import numpy as np
+import torch
+
+# Cell
+def _concatenate_padded(sequences, pad_left, pad_right):
+    """
+    Edge pads each sequence and concatenates them along the frame axis.
+    Returns the array and the index of the first real frame of each sequence.
+    """
+    padded = []
+    for seq in sequences:
+        if seq.shape[0] == 0:
+            # Nothing to edge pad with, these frames are never gathered.
+            padded.append(np.zeros(
+                (pad_left + pad_right, *seq.shape[1:]), dtype=seq.dtype))
+        else:
+            padded.append(np.pad(
+                seq, ((pad_left, pad_right), (0, 0), (0, 0)), 'edge'))
+    lengths = [len(seq) for seq in padded]
+    seq_start = np.cumsum([0] + lengths[:-1]) + pad_left
+    return np.concatenate(padded), seq_start
+
+def _append_flipped(poses, left, right):
+    """
+    Returns the poses followed by a horizontally flipped copy,
+    where the left and right joints are swapped.
+    """
+    flipped = poses.copy()
+    flipped[..., 0] *= -1
+    flipped[:, left + right] = flipped[:, right + left]
+    return np.concatenate((poses, flipped))
+
+def _as_dtype(sequences, dtype):
+    """Returns the sequences in the given dtype, without copying those already in it."""
+    if sequences is None:
+        return None
+    return [np.asarray(seq, dtype=dtype) for seq in sequences]
+
+def _has_dtype(batch, dtype):
+    """Returns True if all arrays of a batch are of the given dtype."""
+    return all(array is None or array.dtype == dtype for array in batch)
 
 # Cell
 class ChunkedGenerator:
@@ -40,41 +83,63 @@ class ChunkedGenerator:
 
     joints_left and joints_right -- List of left/right 3D joints if
         flipping is enabled.
+
+    prepad -- Pad all sequences once when the generator is created and
+        gather each batch with a single fancy-index, instead of padding
+        and flipping sample by sample (faster, uses slightly more memory).
+
+    dtype -- Floating point type of the stored sequences and the batches.
     """
+    # Packed record for a chunk, 13 bytes instead of a Python tuple.
+    pairs_dtype = np.dtype([
+        ('seq', np.int32), ('start', np.int32),
+        ('end', np.int32), ('flip', np.bool_)
+    ])
+
     def __init__(
             self, batch_size, cameras, poses_3d, poses_2d, chunk_length, pad=0,
             causal_shift=0, shuffle=True, random_seed=47, augment=False,
             kps_left=None, kps_right=None, joints_left=None,
-            joints_right=None, endless=False):
+            joints_right=None, endless=False, prepad=False, dtype='float32'):
 
         assert poses_3d is None or len(poses_3d) == len(poses_2d), "Number of 3D poses and 2D poses differ."
         assert cameras is None or len(cameras) == len(poses_2d)
+        self.dtype = np.dtype(dtype)
+        cameras = _as_dtype(cameras, self.dtype)
+        poses_3d = _as_dtype(poses_3d, self.dtype)
+        poses_2d = _as_dtype(poses_2d, self.dtype)
 
-        # Build lineage info
-        pairs = [] # (seq_idx, start_frame, end_frame, flip) tuples
+        # Build lineage info, one (seq, start, end, flip) record per chunk.
+        pairs = [np.empty(0, dtype=self.pairs_dtype)]
         for i in range(len(poses_2d)):
             n_chunks = (poses_2d[i].shape[0] + chunk_length - 1) // chunk_length
             offset = (n_chunks * chunk_length - poses_2d[i].shape[0]) // 2
             bounds = np.arange(n_chunks+1)*chunk_length - offset
-            augment_vector = np.full(len(bounds - 1), False, dtype=bool)
-            pairs += zip(np.repeat(
-                i, len(bounds - 1)), bounds[:-1], bounds[1:], augment_vector)
+            seq_pairs = np.empty(n_chunks, dtype=self.pairs_dtype)
+            seq_pairs['seq'] = i
+            seq_pairs['start'] = bounds[:-1]
+            seq_pairs['end'] = bounds[1:]
+            seq_pairs['flip'] = False
+            pairs.append(seq_pairs)
             if augment:
-                pairs += zip(np.repeat(
-                    i, len(bounds - 1)), bounds[:-1], bounds[1:], ~augment_vector)
+                seq_pairs = seq_pairs.copy()
+                seq_pairs['flip'] = True
+                pairs.append(seq_pairs)
+        pairs = np.concatenate(pairs)
 
         # Initialize buffers
         if cameras is not None:
-            self.batch_cam = np.empty((batch_size, cameras[0].shape[-1]))
+            self.batch_cam = np.empty(
+                (batch_size, cameras[0].shape[-1]), dtype=self.dtype)
         if poses_3d is not None:
             self.batch_3d = np.empty((
                 batch_size, chunk_length,
                 poses_3d[0].shape[-2], poses_3d[0].shape[-1]
-            ))
+            ), dtype=self.dtype)
         self.batch_2d = np.empty((
             batch_size, chunk_length + 2*pad,
             poses_2d[0].shape[-2], poses_2d[0].shape[-1]
-        ))
+        ), dtype=self.dtype)
 
         # Initialize instance variables.
         self.num_batches = (len(pairs) + batch_size - 1) // batch_size
@@ -97,6 +162,83 @@ class ChunkedGenerator:
         self.joints_left = joints_left
         self.joints_right = joints_right
 
+        self.prepad = prepad
+        if prepad:
+            self._prepad_sequences(chunk_length)
+
+    def _prepad_sequences(self, chunk_length):
+        """
+        Edge pads all sequences once and stores them back to back,
+        so that next_epoch can gather a whole batch at a time.
+        When augmentation is enabled a flipped copy is stored after the
+        original, and flipped samples are read from there.
+        """
+        # Chunks can start and end up to chunk_length frames outside
+        # of a sequence.
+        self.padded_2d, self.seq_start_2d = _concatenate_padded(
+            self.poses_2d, self.pad + self.causal_shift + chunk_length,
+            self.pad - self.causal_shift + chunk_length
+        )
+        self.window_2d = np.arange(
+            chunk_length + 2*self.pad) - self.pad - self.causal_shift
+        if self.augment:
+            self.padded_2d = _append_flipped(
+                self.padded_2d, self.kps_left, self.kps_right)
+
+        if self.poses_3d is not None:
+            self.padded_3d, self.seq_start_3d = _concatenate_padded(
+                self.poses_3d, chunk_length, chunk_length)
+            self.window_3d = np.arange(chunk_length)
+            if self.augment:
+                self.padded_3d = _append_flipped(
+                    self.padded_3d, self.joints_left, self.joints_right)
+
+        if self.cameras is not None:
+            self.cameras_array = np.stack(self.cameras)
+            if self.augment:
+                # Flip horizontal distortion coefficients
+                flipped = self.cameras_array.copy()
+                flipped[:, [2, 7]] *= -1
+                self.cameras_array = np.concatenate(
+                    (self.cameras_array, flipped))
+
+    def _gather_batch(self, chunks):
+        """Fills the batch buffers with one fancy-index per buffer."""
+        n = len(chunks)
+        seq_idx = chunks['seq'].astype(np.int64)
+        start_3d = chunks['start'].astype(np.int64)
+        flip = chunks['flip']
+
+        # 2D poses, flipped samples are read from the second half.
+        first = self.seq_start_2d[seq_idx] + start_3d
+        first[flip] += len(self.padded_2d) // 2
+        np.take(self.padded_2d, first[:, None] + self.window_2d, axis=0,
+                out=self.batch_2d[:n], mode='clip')
+
+        # 3D poses
+        if self.poses_3d is not None:
+            first = self.seq_start_3d[seq_idx] + start_3d
+            first[flip] += len(self.padded_3d) // 2
+            np.take(self.padded_3d, first[:, None] + self.window_3d, axis=0,
+                    out=self.batch_3d[:n], mode='clip')
+
+        # Cameras
+        if self.cameras is not None:
+            seq_idx[flip] += len(self.cameras)
+            self.batch_cam[:n] = self.cameras_array[seq_idx]
+
+    def memory_usage(self):
+        """
+        Returns the number of bytes used by the chunk index, the batch
+        buffers and the prepadded sequences (if enabled).
+        """
+        arrays = [self.pairs, self.batch_2d]
+        for name in ['batch_3d', 'batch_cam', 'padded_2d',
+                     'padded_3d', 'cameras_array']:
+            if hasattr(self, name):
+                arrays.append(getattr(self, name))
+        return sum(array.nbytes for array in arrays)
+
     def num_frames(self):
         """Returns the total number of frames that we train on."""
         return self.num_batches * self.batch_size
@@ -117,13 +259,92 @@ class ChunkedGenerator:
         """Returns the next pairs or None. Can also shuffle the data."""
         if self.state is None:
             if self.shuffle:
-                pairs = self.random.permutation(self.pairs)
+                pairs = self.pairs[self.random.permutation(len(self.pairs))]
             else:
                 pairs = self.pairs
             return 0, pairs
         else:
             return self.state
 
+    def get_batch(self, chunks):
+        """
+        Fills the batch buffers with the given chunks of pairs.
+        Returns views of the buffers as (cameras, 3D poses, 2D poses),
+        where unused entries are None.
+        """
+        if self.prepad:
+            self._gather_batch(chunks)
+        else:
+            for i, (seq_idx, start_3d, end_3d, flip) in enumerate(chunks):
+                start_2d = start_3d - self.pad - self.causal_shift
+                end_2d = end_3d + self.pad - self.causal_shift
+
+                # 2D poses
+                seq_2d = self.poses_2d[seq_idx]
+                low_2d = max(start_2d, 0)
+                high_2d = min(end_2d, seq_2d.shape[0])
+                pad_left_2d = low_2d - start_2d
+                pad_right_2d = end_2d - high_2d
+                if pad_left_2d != 0 or pad_right_2d != 0:
+                    self.batch_2d[i] = np.pad(
+                        seq_2d[low_2d:high_2d],
+                        ((pad_left_2d, pad_right_2d),
+                        (0, 0), (0, 0)), 'edge'
+                    )
+                else:
+                    self.batch_2d[i] = seq_2d[low_2d:high_2d]
+
+                if flip:
+                    # Flip 2D keypoints
+                    self.batch_2d[i, :, :, 0] *= -1
+                    self.batch_2d[
+                        i, :, self.kps_left + self.kps_right
+                    ] = self.batch_2d[
+                        i, :, self.kps_right + self.kps_left
+                    ]
+
+                # 3D poses
+                if self.poses_3d is not None:
+                    seq_3d = self.poses_3d[seq_idx]
+                    low_3d = max(start_3d, 0)
+                    high_3d = min(end_3d, seq_3d.shape[0])
+                    pad_left_3d = low_3d - start_3d
+                    pad_right_3d = end_3d - high_3d
+                    if pad_left_3d != 0 or pad_right_3d != 0:
+                        self.batch_3d[i] = np.pad(
+                            seq_3d[low_3d:high_3d],
+                            ((pad_left_3d, pad_right_3d),
+                            (0, 0), (0, 0)), 'edge'
+                        )
+                    else:
+                        self.batch_3d[i] = seq_3d[low_3d:high_3d]
+
+                    if flip:
+                        # Flip 3D joints
+                        self.batch_3d[i, :, :, 0] *= -1
+                        self.batch_3d[
+                            i, :, self.joints_left + self.joints_right
+                        ] = self.batch_3d[
+                            i, :, self.joints_right + self.joints_left
+                        ]
+
+                # Cameras
+                if self.cameras is not None:
+                    self.batch_cam[i] = self.cameras[seq_idx]
+                    if flip:
+                        # Flip horizontal distortion coefficients
+                        self.batch_cam[i, 2] *= -1
+                        self.batch_cam[i, 7] *= -1
+
+        if self.poses_3d is None and self.cameras is None:
+            return None, None, self.batch_2d[:len(chunks)]
+        elif self.poses_3d is not None and self.cameras is None:
+            return None, self.batch_3d[:len(chunks)], self.batch_2d[:len(chunks)]
+        elif self.poses_3d is None:
+            return self.batch_cam[:len(chunks)], None, self.batch_2d[:len(chunks)]
+        else:
+            return self.batch_cam[:len(chunks)], self.batch_3d[:len(chunks)], self.batch_2d[:len(chunks)]
+
     def next_epoch(self):
         """
         Sets up the next forward pass + backward pass for all the
@@ -137,77 +358,10 @@ class ChunkedGenerator:
                 chunks = pairs[
                     batch_index*self.batch_size : (batch_index+1)*self.batch_size
                 ]
-                for i, (seq_idx, start_3d, end_3d, flip) in enumerate(chunks):
-                    start_2d = start_3d - self.pad - self.causal_shift
-                    end_2d = end_3d + self.pad - self.causal_shift
-
-                    # 2D poses
-                    seq_2d = self.poses_2d[seq_idx]
-                    low_2d = max(start_2d, 0)
-                    high_2d = min(end_2d, seq_2d.shape[0])
-                    pad_left_2d = low_2d - start_2d
-                    pad_right_2d = end_2d - high_2d
-                    if pad_left_2d != 0 or pad_right_2d != 0:
-                        self.batch_2d[i] = np.pad(
-                            seq_2d[low_2d:high_2d],
-                            ((pad_left_2d, pad_right_2d),
-                            (0, 0), (0, 0)), 'edge'
-                        )
-                    else:
-                        self.batch_2d[i] = seq_2d[low_2d:high_2d]
-
-                    if flip:
-                        # Flip 2D keypoints
-                        self.batch_2d[i, :, :, 0] *= -1
-                        self.batch_2d[
-                            i, :, self.kps_left + self.kps_right
-                        ] = self.batch_2d[
-                            i, :, self.kps_right + self.kps_left
-                        ]
-
-                    # 3D poses
-                    if self.poses_3d is not None:
-                        seq_3d = self.poses_3d[seq_idx]
-                        low_3d = max(start_3d, 0)
-                        high_3d = min(end_3d, seq_3d.shape[0])
-                        pad_left_3d = low_3d - start_3d
-                        pad_right_3d = end_3d - high_3d
-                        if pad_left_3d != 0 or pad_right_3d != 0:
-                            self.batch_3d[i] = np.pad(
-                                seq_3d[low_3d:high_3d],
-                                ((pad_left_3d, pad_right_3d),
-                                (0, 0), (0, 0)), 'edge'
-                            )
-                        else:
-                            self.batch_3d[i] = seq_3d[low_3d:high_3d]
-
-                        if flip:
-                            # Flip 3D joints
-                            self.batch_3d[i, :, :, 0] *= -1
-                            self.batch_3d[
-                                i, :, self.joints_left + self.joints_right
-                            ] = self.batch_3d[
-                                i, :, self.joints_right + self.joints_left
-                            ]
-
-                    # Cameras
-                    if self.cameras is not None:
-                        self.batch_cam[i] = self.cameras[seq_idx]
-                        if flip:
-                            # Flip horizontal distortion coefficients
-                            self.batch_cam[i, 2] *= -1
-                            self.batch_cam[i, 7] *= -1
-
+                batch = self.get_batch(chunks)
                 if self.endless:
                     self.state = (batch_index + 1, pairs)
-                if self.poses_3d is None and self.cameras is None:
-                    yield None, None, self.batch_2d[:len(chunks)]
-                elif self.poses_3d is not None and self.cameras is None:
-                    yield None, self.batch_3d[:len(chunks)], self.batch_2d[:len(chunks)]
-                elif self.poses_3d is None:
-                    yield self.batch_cam[:len(chunks)], None, self.batch_2d[:len(chunks)]
-                else:
-                    yield self.batch_cam[:len(chunks)], self.batch_3d[:len(chunks)], self.batch_2d[:len(chunks)]
+                yield batch
 
             if self.endless:
                 self.state = None
@@ -247,15 +401,21 @@ class UnchunkedGenerator:
 
     joints_left and joints_right -- list of left/right 3D joints if
         flipping is enabled
+
+    dtype -- floating point type of the stored sequences and the batches
     """
 
     def __init__(
             self, cameras, poses_3d, poses_2d, pad=0, causal_shift=0,
             augment=False, kps_left=None, kps_right=None,
-            joints_left=None, joints_right=None):
+            joints_left=None, joints_right=None, dtype='float32'):
 
         assert poses_3d is None or len(poses_3d) == len(poses_2d)
         assert cameras is None or len(cameras) == len(poses_2d)
+        self.dtype = np.dtype(dtype)
+        cameras = _as_dtype(cameras, self.dtype)
+        poses_3d = _as_dtype(poses_3d, self.dtype)
+        poses_2d = _as_dtype(poses_2d, self.dtype)
 
         self.augment = augment
         self.kps_left = kps_left
@@ -284,39 +444,284 @@ class UnchunkedGenerator:
         """Turn on and turn off data augmentation."""
         self.augment = augment
 
+    def get_batch(self, seq_cam, seq_3d, seq_2d):
+        """
+        Returns the batch (cameras, 3D poses, 2D poses) for one sequence,
+        with the flipped version appended if augmentation is enabled.
+        """
+        batch_cam = None if seq_cam is None else np.expand_dims(seq_cam, axis=0)
+        # Copied since the caller may zero the root joint in place.
+        batch_3d = None if seq_3d is None else np.array(seq_3d[None])
+        # a and b are help variables only.
+        a, b = self.pad + self.causal_shift, self.pad - self.causal_shift
+        batch_2d = np.expand_dims(np.pad(
+            seq_2d,((a, b), (0, 0), (0, 0)), 'edge'), axis=0
+        )
+
+        if self.augment:
+            batch_cam, batch_3d, batch_2d = self._append_flipped_batch(
+                batch_cam, batch_3d, batch_2d)
+
+        batch = batch_cam, batch_3d, batch_2d
+        assert _has_dtype(batch, self.dtype), 'Batch upcast from {}.'.format(self.dtype)
+        return batch
+
+    def _append_flipped_batch(self, batch_cam, batch_3d, batch_2d):
+        """Appends a mirrored copy of each sequence after the originals."""
+        n = batch_2d.shape[0]
+        if batch_cam is not None:
+            batch_cam = np.concatenate((batch_cam, batch_cam), axis=0)
+            batch_cam[n:, 2] *= -1
+            batch_cam[n:, 7] *= -1
+
+        if batch_3d is not None:
+            batch_3d = np.concatenate((batch_3d, batch_3d), axis=0)
+            batch_3d[n:, :, :, 0] *= -1
+            batch_3d[n:, :, self.joints_left + self.joints_right] \
+                 = batch_3d[n:, :, self.joints_right + self.joints_left]
+
+        batch_2d = np.concatenate((batch_2d, batch_2d), axis=0)
+        batch_2d[n:, :, :, 0] *= -1
+        batch_2d[n:, :, self.kps_left + self.kps_right] \
+            = batch_2d[n:, :, self.kps_right + self.kps_left]
+        return batch_cam, batch_3d, batch_2d
+
+    def get_packed_batch(self, indices):
+        """
+        Returns the sequences with the given indices in one batch
+        (cameras, 3D poses, 2D poses, mask). Shorter sequences are edge
+        padded at the end to the longest one, and mask[i, t] is True
+        if frame t is part of sequence i. If augmentation is enabled the
+        flipped sequences follow the originals.
+        """
+        lengths = np.array([self.poses_2d[i].shape[0] for i in indices])
+        n_frames = lengths.max()
+        a, b = self.pad + self.causal_shift, self.pad - self.causal_shift
+        batch_2d = np.stack([
+            np.pad(self.poses_2d[i],
+                   ((a, b + n_frames - length), (0, 0), (0, 0)), 'edge')
+            for i, length in zip(indices, lengths)
+        ])
+        batch_3d = None
+        if len(self.poses_3d) > 0:
+            batch_3d = np.stack([
+                np.pad(self.poses_3d[i],
+                       ((0, n_frames - length), (0, 0), (0, 0)), 'edge')
+                for i, length in zip(indices, lengths)
+            ])
+        batch_cam = None
+        if len(self.cameras) > 0:
+            batch_cam = np.stack([self.cameras[i] for i in indices])
+        mask = np.arange(n_frames) < lengths[:, None]
+
+        if self.augment:
+            batch_cam, batch_3d, batch_2d = self._append_flipped_batch(
+                batch_cam, batch_3d, batch_2d)
+            mask = np.concatenate((mask, mask))
+
+        assert _has_dtype((batch_cam, batch_3d, batch_2d), self.dtype), \
+            'Batch upcast from {}.'.format(self.dtype)
+        return batch_cam, batch_3d, batch_2d, mask
+
+    def next_packed_epoch(self, max_frames):
+        """
+        Like next_epoch, but packs sequences of similar length into one
+        batch of at most max_frames padded frames per copy (a longer
+        sequence gets a batch of its own). Yields (indices, cameras,
+        3D poses, 2D poses, mask), see get_packed_batch, shortest
+        sequences first.
+        """
+        lengths = [pose.shape[0] for pose in self.poses_2d]
+        indices = []
+        for i in np.argsort(lengths, kind='stable'):
+            # Sorted by length, so the new sequence is the longest one.
+            # Each sequence is padded by the receptive field.
+            if indices and (len(indices) + 1) * (lengths[i] + 2*self.pad) > max_frames:
+                yield (indices, *self.get_packed_batch(indices))
+                indices = []
+            indices.append(i)
+        if indices:
+            yield (indices, *self.get_packed_batch(indices))
+
     def next_epoch(self):
         """
         Sets up the next forward pass for all the test samples.
         Returns (or yields) a generator object.
         """
-
         for seq_cam, seq_3d, seq_2d in zip_longest(
                 self.cameras, self.poses_3d, self.poses_2d):
+            yield self.get_batch(seq_cam, seq_3d, seq_2d)
+
+# Cell
+class PrefetchGenerator:
+    """
+    Prepares batches in the background while the model is training.
+    Wraps a ChunkedGenerator or UnchunkedGenerator and yields its batches
+    as torch tensors, in the same order as the wrapped generator.
+    The tensors share memory with freshly allocated batch arrays, so
+    there is no extra copy and they stay valid after the next batch.
 
-            batch_cam = None if seq_cam is None else np.expand_dims(seq_cam, axis=0)
-            batch_3d = None if seq_3d is None else np.expand_dims(seq_3d, axis=0)
-            # a and b are help variables only.
-            a, b = self.pad + self.causal_shift, self.pad - self.causal_shift
-            batch_2d = np.expand_dims(np.pad(
-                seq_2d,((a, b), (0, 0), (0, 0)), 'edge'), axis=0
-            )
+    Each worker has its own copy of the generator with its own buffers
+    and builds every num_workers:th batch of the epoch. The shuffling
+    is still done by the wrapped generator, so its random state can be
+    saved in checkpoints as before.
 
-        if self.augment:
-                # Append flipped version
-                if batch_cam is not None:
-                    batch_cam = np.concatenate((batch_cam, batch_cam), axis=0)
-                    batch_cam[1, 2] *= -1
-                    batch_cam[1, 7] *= -1
-
-                if batch_3d is not None:
-                    batch_3d = np.concatenate((batch_3d, batch_3d), axis=0)
-                    batch_3d[1, :, :, 0] *= -1
-                    batch_3d[1, :, self.joints_left + self.joints_right] \
-                         = batch_3d[1, :, self.joints_right + self.joints_left]
-
-                batch_2d = np.concatenate((batch_2d, batch_2d), axis=0)
-                batch_2d[1, :, :, 0] *= -1
-                batch_2d[1, :, self.kps_left + self.kps_right] \
-                    = batch_2d[1, :, self.kps_right + self.kps_left]
-
-        yield batch_cam, batch_3d, batch_2d
\ No newline at end of file
+    Arguments:
+    generator -- The ChunkedGenerator or UnchunkedGenerator to wrap.
+    num_workers -- Number of workers building batches,
+        0 builds the batches in the calling thread.
+
+    queue_depth -- Number of ready batches each worker can keep waiting.
+    processes -- Use worker processes instead of threads.
+    seed -- Worker k is seeded with seed + k.
+    """
+
+    def __init__(
+            self, generator, num_workers=1, queue_depth=2,
+            processes=False, seed=0):
+        self.generator = generator
+        self.num_workers = num_workers
+        self.queue_depth = queue_depth
+        self.processes = processes
+        self.seed = seed
+
+    def num_frames(self):
+        """Returns the number of frames of the wrapped generator."""
+        return self.generator.num_frames()
+
+    def augment_enabled(self):
+        """Returns a boolean if we use data-augmentation or not."""
+        return self.generator.augment_enabled()
+
+    def _epoch_items(self):
+        """
+        Returns the arguments to get_batch for the rest of the epoch
+        together with the shuffled pairs (None for UnchunkedGenerator).
+        """
+        generator = self.generator
+        if isinstance(generator, ChunkedGenerator):
+            start_idx, pairs = generator.next_pairs()
+            items = [
+                (pairs[i*generator.batch_size : (i+1)*generator.batch_size],)
+                for i in range(start_idx, generator.num_batches)
+            ]
+            return items, start_idx, pairs
+        items = list(zip_longest(
+            generator.cameras, generator.poses_3d, generator.poses_2d))
+        return items, 0, None
+
+    def _worker_generator(self):
+        """Returns a copy of the generator that can get its own buffers."""
+        return copy.copy(self.generator)
+
+    def next_epoch(self):
+        """
+        Yields (cameras, 3D poses, 2D poses) tensors for the next epoch,
+        where unused entries are None.
+        """
+        endless = getattr(self.generator, 'endless', False)
+        enabled = True
+        while enabled:
+            items, start_idx, pairs = self._epoch_items()
+            if self.num_workers == 0:
+                generator = self._worker_generator()
+                batches = (_build_batch(generator, item) for item in items)
+            else:
+                batches = self._prefetch(items)
+
+            try:
+                for batch_index, batch in enumerate(batches, start_idx):
+                    if endless:
+                        self.generator.state = (batch_index + 1, pairs)
+                    yield batch
+            finally:
+                # Stops the workers if the epoch is abandoned.
+                batches.close()
+
+            if endless:
+                self.generator.state = None
+            else:
+                enabled = False
+
+    def _prefetch(self, items):
+        """Starts the workers for one epoch and yields their batches in order."""
+        if self.processes:
+            context = torch.multiprocessing.get_context('fork')
+            stop = context.Event()
+            queues = [
+                context.Queue(self.queue_depth) for _ in range(self.num_workers)]
+            Worker = context.Process
+        else:
+            stop = threading.Event()
+            queues = [
+                queue.Queue(self.queue_depth) for _ in range(self.num_workers)]
+            Worker = threading.Thread
+
+        workers = []
+        for k in range(self.num_workers):
+            workers.append(Worker(
+                target=_prefetch_worker, daemon=True,
+                args=(self._worker_generator(), items[k::self.num_workers],
+                      queues[k], stop, self.seed + k, self.processes)
+            ))
+            workers[-1].start()
+
+        try:
+            for i in range(len(items)):
+                k = i % self.num_workers
+                while True:
+                    try:
+                        batch = queues[k].get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if not workers[k].is_alive():
+                            raise RuntimeError('Prefetch worker {} died.'.format(k))
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join(timeout=5)
+                if self.processes and worker.is_alive():
+                    worker.terminate()
+
+
+def _build_batch(generator, item):
+    """
+    Builds one batch in new buffers of the generator and returns it as
+    tensors sharing memory with them.
+    """
+    for name in ['batch_cam', 'batch_3d', 'batch_2d']:
+        if hasattr(generator, name):
+            setattr(generator, name, np.empty_like(getattr(generator, name)))
+    batch = generator.get_batch(*item)
+    assert _has_dtype(batch, generator.dtype), 'Batch upcast from {}.'.format(generator.dtype)
+    return tuple(
+        None if array is None else torch.from_numpy(array) for array in batch)
+
+
+def _prefetch_worker(generator, items, batch_queue, stop, seed, process):
+    """Builds the batches for the given items and puts them on the queue."""
+    if hasattr(generator, 'random'):
+        generator.random = np.random.RandomState(seed)
+    if process:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        torch.set_num_threads(1)
+    for item in items:
+        try:
+            batch = _build_batch(generator, item)
+        except Exception as e:
+            batch = e
+        while not stop.is_set():
+            try:
+                batch_queue.put(batch, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if stop.is_set() or isinstance(batch, Exception):
+            break
+    # Tensors from a worker process live in its shared memory, so it
+    # stays alive until the consumer is done with the epoch.
+    stop.wait()
\ No newline at end of file
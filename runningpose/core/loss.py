@@ -1,6 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/01_loss.ipynb (unless otherwise specified).
 
-__all__ = ['mpjpe', 'p_mpjpe', 'mean_velocity_error', 'weighted_mpjpe', 'n_mpjpe']
+__all__ = ['mpjpe', 'p_mpjpe', 'mean_velocity_error', 'weighted_mpjpe', 'n_mpjpe', 'procrustes_align', 'p_mpjpe_torch',
+           'p_mpjpe_fast', 'scale_align', 'mean_velocity_error_torch', 'ErrorAccumulator']
 
 # Cell
 import numpy as np
@@ -98,3 +99,223 @@ def n_mpjpe(predicted, target):
         target*predicted, dim=3, keepdim=True), dim=2, keepdim=True)
     scale = norm_target / norm_predicted
     return mpjpe(scale * predicted, target)
+
+
+# Cell
+def procrustes_align(predicted, target, closed_form=True):
+    """
+    Torch version of the alignment in p_mpjpe, batched over any leading
+    dimensions of (*, J, 3) poses. Returns the predicted poses after
+    rigid alignment (scale, rotation, and translation) to the target.
+
+    With closed_form the rotation is found with Horn's quaternion method
+    instead of an SVD, see _rotation_quaternion. It is faster, but its
+    check for frames that need the SVD waits for the device.
+    """
+    assert predicted.shape == target.shape
+
+    muX = torch.mean(target, dim=-2, keepdim=True)
+    muY = torch.mean(predicted, dim=-2, keepdim=True)
+    X0 = target - muX
+    Y0 = predicted - muY
+    normX = torch.sqrt(torch.sum(X0**2, dim=(-2, -1), keepdim=True))
+    normY = torch.sqrt(torch.sum(Y0**2, dim=(-2, -1), keepdim=True))
+    X0 = X0 / normX
+    Y0 = Y0 / normY
+
+    if closed_form:
+        R, tr = _rotation_quaternion(X0, Y0)
+    else:
+        R, tr = _rotation_svd(X0, Y0)
+
+    # Scale a = tr * normX / normY and translation t = muX - a*muY @ R,
+    # applied to the centered poses.
+    return tr*normX*torch.matmul(Y0, R) + muX
+
+def p_mpjpe_torch(predicted, target, closed_form=True):
+    """Torch version of p_mpjpe, returns a tensor on the same device."""
+    return mpjpe(procrustes_align(predicted, target, closed_form), target)
+
+def p_mpjpe_fast(predicted, target):
+    """
+    Same as p_mpjpe, but uses the closed form 3x3 alignment which is
+    several times faster.
+    """
+    return p_mpjpe_torch(
+        torch.as_tensor(np.ascontiguousarray(predicted)),
+        torch.as_tensor(np.ascontiguousarray(target))).item()
+
+def _rotation_svd(X0, Y0):
+    """
+    Returns the rotation R that best maps the normalized poses Y0 onto
+    X0 as Y0 @ R, and the sum of the singular values (the trace).
+    """
+    H = torch.matmul(X0.transpose(-1, -2), Y0)
+    U, s, Vt = torch.linalg.svd(H)
+    V = Vt.transpose(-1, -2)
+    R = torch.matmul(V, U.transpose(-1, -2))
+
+    # Avoid improper rotations (reflections), i.e. rotations with det(R) = -1.
+    sign_detR = torch.sign(torch.linalg.det(R)).unsqueeze(-1)
+    V[..., -1] *= sign_detR
+    s[..., -1] *= sign_detR.squeeze(-1)
+    R = torch.matmul(V, U.transpose(-1, -2)) # Rotation.
+
+    tr = torch.sum(s, dim=-1, keepdim=True).unsqueeze(-1)
+    return R, tr
+
+# Cell
+def _det3(a, b, c, d, e, f, g, h, i):
+    """Elementwise determinant of [[a, b, c], [d, e, f], [g, h, i]]."""
+    return a*(e*i - f*h) - b*(d*i - f*g) + c*(d*h - e*g)
+
+def _cofactor4(A, row, col):
+    """Elementwise cofactor of a 4x4 matrix given as nested lists."""
+    minor = [
+        A[i][j] for i in range(4) if i != row
+        for j in range(4) if j != col
+    ]
+    return (-1)**(row + col) * _det3(*minor)
+
+def _rotation_quaternion(X0, Y0, iterations=20):
+    """
+    Same as _rotation_svd, but with Horn's quaternion method written out
+    elementwise, so that it is vectorized over all frames.
+
+    The best rotation is the eigenvector of the largest eigenvalue of a
+    symmetric 4x4 matrix N built from the covariance of the poses, and
+    that eigenvalue is the trace with reflections already handled.
+    The eigenvalue is found with Newton's method on the characteristic
+    polynomial of N, starting from its upper bound 1 (the poses have
+    unit norm), and the eigenvector is a column of the adjugate of
+    N - eigenvalue * I. Frames where Newton's method has not converged,
+    which happens when the largest eigenvalue is (close to) not unique,
+    fall back to the SVD.
+    """
+    H = torch.matmul(Y0.transpose(-1, -2), X0)
+    (xx, xy, xz), (yx, yy, yz), (zx, zy, zz) = [
+        [H[..., i, j] for j in range(3)] for i in range(3)]
+    N = [
+        [xx + yy + zz, yz - zy, zx - xz, xy - yx],
+        [yz - zy, xx - yy - zz, xy + yx, zx + xz],
+        [zx - xz, xy + yx, yy - xx - zz, yz + zy],
+        [xy - yx, zx + xz, yz + zy, zz - xx - yy],
+    ]
+
+    # Characteristic polynomial lambda^4 + c2 lambda^2 + c1 lambda + c0.
+    c2 = -2 * torch.sum(H**2, dim=(-2, -1))
+    c1 = -8 * _det3(xx, xy, xz, yx, yy, yz, zx, zy, zz)
+    c0 = sum(N[0][j] * _cofactor4(N, 0, j) for j in range(4))
+    eigenvalue = torch.ones_like(c0)
+    for _ in range(iterations):
+        p = ((eigenvalue**2 + c2)*eigenvalue + c1)*eigenvalue + c0
+        dp = (4*eigenvalue**2 + 2*c2)*eigenvalue + c1
+        step = p / torch.where(dp == 0, torch.ones_like(dp), dp)
+        eigenvalue = eigenvalue - step
+
+    # Every column of the adjugate is a multiple of the eigenvector,
+    # the one with the largest diagonal element is the most accurate.
+    A = [[N[i][j] - eigenvalue*(i == j) for j in range(4)] for i in range(4)]
+    # The adjugate is symmetric since A is.
+    cofactors = {(i, j): _cofactor4(A, i, j) for i in range(4) for j in range(i, 4)}
+    adjugate = torch.stack([
+        torch.stack([cofactors[min(i, j), max(i, j)] for j in range(4)], dim=-1)
+        for i in range(4)
+    ], dim=-2)
+    diagonal = torch.diagonal(adjugate, dim1=-2, dim2=-1)
+    col = torch.argmax(torch.abs(diagonal), dim=-1, keepdim=True)
+    q = torch.take_along_dim(adjugate, col.unsqueeze(-1), dim=-1).squeeze(-1)
+    q = q / torch.norm(q, dim=-1, keepdim=True)
+
+    q0, q1, q2, q3 = q.unbind(-1)
+    R = torch.stack([
+        q0*q0 + q1*q1 - q2*q2 - q3*q3, 2*(q1*q2 + q0*q3), 2*(q1*q3 - q0*q2),
+        2*(q1*q2 - q0*q3), q0*q0 - q1*q1 + q2*q2 - q3*q3, 2*(q2*q3 + q0*q1),
+        2*(q1*q3 + q0*q2), 2*(q2*q3 - q0*q1), q0*q0 - q1*q1 - q2*q2 + q3*q3,
+    ], dim=-1).reshape(*q.shape[:-1], 3, 3)
+    tr = eigenvalue[..., None, None]
+
+    # Newton's method only converges slowly to a multiple eigenvalue.
+    tolerance = torch.finfo(eigenvalue.dtype).eps ** 0.5
+    degenerate = (torch.abs(step) > tolerance) | ~torch.isfinite(q).all(dim=-1)
+    if degenerate.any():
+        R[degenerate], tr[degenerate] = _rotation_svd(X0[degenerate], Y0[degenerate])
+    return R, tr
+
+# Cell
+def scale_align(predicted, target):
+    """
+    Scales each predicted (*, J, 3) pose to best fit the target, as
+    done in n_mpjpe.
+    """
+    norm_predicted = torch.mean(torch.sum(
+        predicted**2, dim=-1, keepdim=True), dim=-2, keepdim=True)
+    norm_target = torch.mean(torch.sum(
+        target*predicted, dim=-1, keepdim=True), dim=-2, keepdim=True)
+    return norm_target / norm_predicted * predicted
+
+def mean_velocity_error_torch(predicted, target):
+    """Torch version of mean_velocity_error, frames along the first dimension."""
+    assert predicted.shape == target.shape
+    return mpjpe(torch.diff(predicted, dim=0), torch.diff(target, dim=0))
+
+# Cell
+class ErrorAccumulator:
+    """
+    Sums the MPJPE, P-MPJPE, N-MPJPE and velocity errors (MPJVE) of
+    sequences per joint and per action, on the device of the poses.
+
+    Every sequence is weighted by its number of frames, also for the
+    velocity error, which is how the errors are averaged in run.py.
+    The sums stay on the device until joint_errors or errors is called,
+    so adding a sequence does not wait for the device.
+    """
+    metrics = ['mpjpe', 'p_mpjpe', 'n_mpjpe', 'mpjve']
+
+    def __init__(self):
+        self.sums = {}
+        self.frames = {}
+
+    def add(self, predicted, target, action=None):
+        """Adds the errors of one sequence of (frames, joints, 3) poses."""
+        assert predicted.shape == target.shape
+        n_frames = target.shape[0]
+        velocity = torch.norm(
+            torch.diff(predicted, dim=0) - torch.diff(target, dim=0), dim=-1)
+        if n_frames > 1:
+            velocity = velocity.sum(dim=0) * n_frames / (n_frames - 1)
+        else:
+            velocity = velocity.sum(dim=0)
+        errors = torch.stack([
+            torch.norm(predicted - target, dim=-1).sum(dim=0),
+            # The closed form checks its frames on the host, the SVD does not wait.
+            torch.norm(procrustes_align(predicted, target, closed_form=False) - target, dim=-1).sum(dim=0),
+            torch.norm(scale_align(predicted, target) - target, dim=-1).sum(dim=0),
+            velocity,
+        ])
+        if action in self.sums:
+            self.sums[action] += errors
+        else:
+            self.sums[action] = errors
+        self.frames[action] = self.frames.get(action, 0) + n_frames
+
+    def actions(self):
+        """Returns the actions that sequences were added for."""
+        return list(self.sums.keys())
+
+    def joint_errors(self, action=None):
+        """
+        Returns a (metrics, joints) NumPy array with the mean error per
+        joint, for one action or all of them if action is None.
+        """
+        if action is None:
+            sums = sum(self.sums.values())
+            frames = sum(self.frames.values())
+        else:
+            sums = self.sums[action]
+            frames = self.frames[action]
+        return sums.cpu().double().numpy() / frames
+
+    def errors(self, action=None):
+        """Returns the mean errors in the order of ErrorAccumulator.metrics."""
+        return self.joint_errors(action).mean(axis=1)
\ No newline at end of file
@@ -1,11 +1,14 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/03_mocap_dataset.ipynb (unless otherwise specified).
 
-__all__ = ['MocapDataset']
+__all__ = ['MocapDataset', 'ActionData', 'dataset_source', 'load_dataset', 'convert_dataset']
 
 # Cell
+import os
+
 import numpy as np
 
 from .skeleton import Skeleton
+from .utils import load_array_tree, save_array_tree
 
 # Cell
 class MocapDataset:
@@ -17,11 +20,13 @@ class MocapDataset:
     fps -- Frames per second.
     data -- Must be filled by subclass.
     cameras -- Must be filled by subclass.
+    dtype -- Floating point type of the camera parameters and positions.
     """
 
-    def __init__(self, fps, skeleton):
+    def __init__(self, fps, skeleton, dtype='float32'):
         self._skeleton = skeleton
         self._fps = fps
+        self._dtype = np.dtype(dtype)
         self._data = None
         self._cameras = None
 
@@ -34,7 +39,9 @@ class MocapDataset:
         for subject in self._data.keys():
             for action in self._data[subject].keys():
                 data = self._data[subject][action]
-                if "positions" in data:
+                if isinstance(data, ActionData):
+                    data.select_joints(kept_joints)
+                elif "positions" in data:
                     data["positions"] = data["positions"][:, kept_joints]
 
     # Bunch of getters.
@@ -51,4 +58,101 @@ class MocapDataset:
         return self._skeleton
 
     def cameras(self):
-        return self._cameras
\ No newline at end of file
+        return self._cameras
+
+    def dtype(self):
+        return self._dtype
+
+# Cell
+class ActionData(dict):
+    """
+    The data of one action, e.g. its positions and cameras. The positions
+    are only read, with the kept joints and in the dataset dtype, when
+    they are first used, so memory-mapped sequences stay on disk until then.
+    """
+
+    def __init__(self, positions=None, dtype='float32', **data):
+        super().__init__(**data)
+        self._pending = positions is not None
+        self._joints = None
+        self._dtype = np.dtype(dtype)
+        if self._pending:
+            super().__setitem__('positions', positions)
+
+    def select_joints(self, kept_joints):
+        """Keeps only the given joints of the positions."""
+        if not self._pending:
+            self['positions'] = self['positions'][:, kept_joints]
+        elif self._joints is None:
+            self._joints = np.asarray(kept_joints)
+        else:
+            self._joints = self._joints[kept_joints]
+
+    def __getitem__(self, key):
+        if key == 'positions' and self._pending:
+            positions = super().__getitem__(key)
+            if self._joints is not None:
+                positions = positions[:, self._joints]
+            self['positions'] = np.asarray(positions, dtype=self._dtype)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if key == 'positions':
+            self._pending = False
+        super().__setitem__(key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+# Cell
+def dataset_source(path):
+    """
+    Returns the store converted from a dataset npz file if there is one,
+    otherwise the npz file itself.
+    """
+    store = os.path.splitext(path)[0]
+    if os.path.exists(os.path.join(store, 'index.json')):
+        return store
+    return path
+
+def load_dataset(path, key):
+    """
+    Loads an entry, e.g. positions_3d, of a dataset npz file, or of its
+    store if it has been converted with convert_dataset. The arrays of a
+    store are memory-mapped.
+    """
+    source = dataset_source(path)
+    if source != path:
+        return load_array_tree(source)[key]
+    value = np.load(path, allow_pickle=True)[key]
+    if value.dtype == object and value.shape == ():
+        value = value.item()
+    return value
+
+def convert_dataset(path, dtype='float32', fps=None):
+    """
+    Converts a dataset npz file, e.g. data_3d_h36m.npz, to a store in
+    the directory of the same name, e.g. data_3d_h36m. Floating point
+    arrays are saved in the given dtype. An existing store is replaced.
+    Returns the directory.
+    """
+    def convert(node):
+        if isinstance(node, dict):
+            return {key: convert(value) for key, value in node.items()}
+        if isinstance(node, (list, tuple)):
+            return [convert(value) for value in node]
+        if isinstance(node, np.ndarray) and node.dtype.kind == 'f':
+            return node.astype(dtype, copy=False)
+        return node
+
+    data = np.load(path, allow_pickle=True)
+    tree = {}
+    for key in data.files:
+        value = data[key]
+        tree[key] = convert(value.item() if value.dtype == object and value.shape == () else value)
+    if fps is not None:
+        tree['fps'] = fps
+
+    directory = os.path.splitext(path)[0]
+    save_array_tree(directory, tree, overwrite=True)
+    return directory
\ No newline at end of file
@@ -1,9 +1,13 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/00_model.ipynb (unless otherwise specified).
 
-__all__ = ['TemporalModelBase', 'TemporalModel']
+__all__ = ['TemporalModelBase', 'TemporalModel', 'TemporalModelOptimized1f', 'StreamingTemporalModel', 'infer_windowed']
 
 # Cell
+import functools
+
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 # Cell
 class TemporalModelBase(nn.Module):
@@ -151,4 +155,205 @@ class TemporalModel(TemporalModelBase):
 
         # Fits the last layer so that it matches our output preferences.
         x = self.shrink(x)
-        return x
\ No newline at end of file
+        return x
+
+# Cell
+class TemporalModelOptimized1f(TemporalModelBase):
+    """
+    3D pose estimation model optimized for single-frame batching, i.e.
+    where batches have input length = receptive field, and output length = 1.
+    This scenario is only used for training when stride == 1.
+
+    This implementation replaces dilated convolutions with strided
+    convolutions to avoid generating unused intermediate results.
+    The weights are interchangeable with the reference implementation.
+    """
+
+    def __init__(
+            self, num_joints_in, in_features, num_joints_out, filter_widths,
+            causal=False, dropout=0.25, channels=1024):
+        """
+        Initialize the optimized temporal model.
+
+        Arguments:
+        num_joints_in -- Number of input joints to our model.
+        in_features -- Number of input features for each joint.
+        num_joints_out -- Number of output joints (can be different than input).
+
+        filter_widths -- List of convolutions,
+            which also determines the number of blocks and receptive field.
+
+        causal -- Use causal convolutions instead of symmetric
+            convolutions (for real-time applications).
+
+        dropout -- Dropout probability.
+        channels -- Number of convolution channels.
+        """
+
+        super().__init__(num_joints_in, in_features, num_joints_out,
+                         filter_widths, causal, dropout, channels)
+        self.expand_conv = nn.Conv1d(
+            num_joints_in*in_features, channels, filter_widths[0],
+            stride=filter_widths[0], bias=False)
+        self.causal_shift = [(filter_widths[0] // 2) if causal else 0]
+
+        # Same layer layout as TemporalModel, but every dilation is a stride.
+        layers_conv = []
+        layers_bn = []
+        next_dilation = filter_widths[0]
+        for i in range(1, len(filter_widths)):
+            self.pad.append((filter_widths[i] - 1)*next_dilation // 2)
+            self.causal_shift.append((filter_widths[i]//2) if causal else 0)
+
+            layers_conv.append(nn.Conv1d(
+                channels, channels, filter_widths[i],
+                stride=filter_widths[i], bias=False))
+            layers_bn.append(nn.BatchNorm1d(channels, momentum=0.1))
+            layers_conv.append(nn.Conv1d(
+                channels, channels, 1, dilation=1, bias=False))
+            layers_bn.append(nn.BatchNorm1d(channels, momentum=0.1))
+
+            next_dilation *= filter_widths[i]
+
+        self.layers_conv = nn.ModuleList(layers_conv)
+        self.layers_bn = nn.ModuleList(layers_bn)
+
+    def _forward_blocks(self, x):
+        x = self.drop(self.relu(self.expand_bn(self.expand_conv(x))))
+
+        for i in range(len(self.pad) - 1):
+            # Keep only the frames that are used by the strided convolution.
+            start = self.causal_shift[i+1] + self.filter_widths[i+1]//2
+            res = x[:, :, start::self.filter_widths[i+1]]
+            x = self.drop(self.relu(
+                self.layers_bn[2*i](self.layers_conv[2*i](x))))
+            x = res + self.drop(self.relu(
+                self.layers_bn[2*i + 1](self.layers_conv[2*i + 1](x))))
+
+        x = self.shrink(x)
+        return x
+
+# Cell
+class StreamingTemporalModel:
+    """
+    Frame-by-frame inference with a causal TemporalModel.
+
+    Each convolution layer keeps a ring buffer with the activations it
+    needs from previous frames, i.e. pad + causal_shift + 1 columns.
+    A new frame then only costs one column of compute per layer
+    instead of a forward pass over the whole receptive field.
+    The buffers start out filled with the first frame, the same way the
+    generators pad the start of a sequence, so the predictions are
+    equal to running the model on the whole sequence.
+    """
+
+    def __init__(self, model):
+        """
+        Arguments:
+        model -- A causal TemporalModel, it is put in evaluation mode.
+        """
+        for pad, shift in zip(model.pad, model.causal_shift):
+            assert pad == shift, "Only causal models can be streamed."
+        self.model = model.eval()
+
+        # The convolutions that look at previous frames, one per ring buffer.
+        self.convs = [model.expand_conv] + list(model.layers_conv[0::2])
+        self.buffer_lengths = []
+        self.taps = []
+        for pad, shift, conv in zip(model.pad, model.causal_shift, self.convs):
+            length = pad + shift + 1
+            kernel_size, dilation = conv.kernel_size[0], conv.dilation[0]
+            # For each write position the buffer columns that the kernel
+            # reads, oldest first.
+            offsets = torch.arange(kernel_size - 1, -1, -1) * dilation
+            heads = torch.arange(length).unsqueeze(1)
+            self.buffer_lengths.append(length)
+            self.taps.append(((heads - offsets) % length).to(conv.weight.device))
+        self.reset()
+
+    def reset(self):
+        """Forget all previous frames, e.g. before starting a new sequence."""
+        self.buffers = [None] * len(self.buffer_lengths)
+        self.frame = 0
+
+    def _step(self, layer, x):
+        """Writes the column x to the ring buffer and convolves one column."""
+        length = self.buffer_lengths[layer]
+        if self.buffers[layer] is None:
+            self.buffers[layer] = x.repeat(1, 1, length)
+        head = self.frame % length
+        self.buffers[layer][:, :, head] = x[:, :, 0]
+        taps = self.buffers[layer][:, :, self.taps[layer][head]]
+        conv = self.convs[layer]
+        return F.conv1d(taps, conv.weight, conv.bias)
+
+    def push(self, frame_2d):
+        """
+        Predicts the 3D pose for a new frame of 2D keypoints.
+
+        Arguments:
+        frame_2d -- Tensor of shape (num_joints_in, in_features),
+            or (N, num_joints_in, in_features) for N parallel streams.
+
+        Returns: Tensor of shape (num_joints_out, 3)
+            or (N, num_joints_out, 3).
+        """
+        model = self.model
+        single = len(frame_2d.shape) == 2
+        assert frame_2d.shape[-2] == model.num_joints_in
+        assert frame_2d.shape[-1] == model.in_features
+
+        with torch.no_grad():
+            x = frame_2d.reshape(-1, model.num_joints_in*model.in_features, 1)
+            x = model.drop(model.relu(model.expand_bn(self._step(0, x))))
+            for i in range(len(model.pad) - 1):
+                # Causal layers keep the newest column as the residual.
+                res = x
+                x = model.drop(model.relu(
+                    model.layers_bn[2*i](self._step(i + 1, x))))
+                x = res + model.drop(model.relu(
+                    model.layers_bn[2*i + 1](model.layers_conv[2*i + 1](x))))
+            x = model.shrink(x)
+        self.frame += 1
+
+        x = x.view(-1, model.num_joints_out, 3)
+        return x[0] if single else x
+
+# Cell
+def infer_windowed(model, inputs_2d, window, executor=None):
+    """
+    Runs the model over a padded sequence a window at a time and
+    stitches the predictions together.
+
+    Each window of input overlaps the next by the receptive field minus
+    one frame, so every output frame sees exactly the same input frames
+    as in a single forward pass over the whole sequence.
+
+    Arguments:
+    model -- A TemporalModel.
+    inputs_2d -- Padded 2D poses (N, T + receptive field - 1, J, C),
+        e.g. a batch from UnchunkedGenerator.
+
+    window -- Number of output frames predicted per forward pass.
+    executor -- Optional thread pool to run the windows on. Torch
+        releases the GIL, so the threads share one model instead of
+        pickling it into every window of a process pool.
+    """
+    halo = model.receptive_field() - 1
+    n_frames = inputs_2d.shape[1] - halo
+    windows = [
+        inputs_2d[:, start : start + window + halo]
+        for start in range(0, n_frames, window)
+    ]
+    infer = functools.partial(_infer_window, model)
+    if executor is None:
+        predictions = map(infer, windows)
+    else:
+        predictions = executor.map(infer, windows)
+    return torch.cat(list(predictions), dim=1)
+
+
+def _infer_window(model, inputs_2d):
+    """Predicts one window, grad mode is per thread so it is set here."""
+    with torch.no_grad():
+        return model(inputs_2d)
\ No newline at end of file
@@ -1,25 +1,40 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/06_quaternion.ipynb (unless otherwise specified).
 
-__all__ = ['qrot', 'qinverse']
+__all__ = ['qrot', 'qinverse', 'qmul', 'qmatrix']
 
 # Cell
+import numpy as np
 import torch
 
+# Cell
+def _stack(arrays, like, axis=-1):
+    """Stacks NumPy arrays or torch tensors, depending on the type of like."""
+    if isinstance(like, torch.Tensor):
+        return torch.stack(arrays, dim=axis)
+    return np.stack(arrays, axis=axis)
+
+def _cross(a, b):
+    """Broadcasting cross product over the last dimension."""
+    if isinstance(a, torch.Tensor):
+        # Broadcasting views, linalg.cross needs the same number of dimensions.
+        return torch.linalg.cross(*torch.broadcast_tensors(a, b), dim=-1)
+    return np.cross(a, b)
+
 # Cell
 def qrot(q, v):
     """
     Rotate vector(s) v about the rotation described by quaternion(s) q.
-    Expects a tensor of shape (*, 4) for q and a tensor of shape (*, 3) for v,
-    where * denotes any number of dimensions.
-    Returns a tensor of shape (*, 3).
+    Expects an array or tensor of shape (*, 4) for q and of shape (*, 3)
+    for v, where * denotes any number of dimensions that broadcast
+    together, e.g. a single quaternion for all vectors.
+    Returns an array or tensor of the broadcasted shape (*, 3).
     """
     assert q.shape[-1] == 4
     assert v.shape[-1] == 3
-    assert q.shape[:-1] == v.shape[:-1]
 
     qvec = q[..., 1:]
-    uv = torch.cross(qvec, v, dim=len(q.shape)-1)
-    uuv = torch.cross(qvec, uv, dim=len(q.shape)-1)
+    uv = _cross(qvec, v)
+    uuv = _cross(qvec, uv)
     return (v + 2 * (q[..., :1] * uv + uuv))
 
 # Cell
@@ -31,4 +46,43 @@ def qinverse(q, inplace=False):
     else:
         w = q[..., :1]
         xyz = q[..., 1:]
-        return torch.cat((w, -xyz), dim=len(q.shape)-1)
\ No newline at end of file
+        if isinstance(q, torch.Tensor):
+            return torch.cat((w, -xyz), dim=len(q.shape)-1)
+        return np.concatenate((w, -xyz), axis=-1)
+
+# Cell
+def qmul(q, r):
+    """
+    Multiply quaternion(s) q with quaternion(s) r, the rotation r is
+    applied first. Expects arrays or tensors of shape (*, 4) that
+    broadcast together and returns the broadcasted shape (*, 4).
+    """
+    assert q.shape[-1] == 4
+    assert r.shape[-1] == 4
+
+    w1, x1, y1, z1 = (q[..., i] for i in range(4))
+    w2, x2, y2, z2 = (r[..., i] for i in range(4))
+    return _stack([
+        w1*w2 - x1*x2 - y1*y2 - z1*z2,
+        w1*x2 + x1*w2 + y1*z2 - z1*y2,
+        w1*y2 - x1*z2 + y1*w2 + z1*x2,
+        w1*z2 + x1*y2 - y1*x2 + z1*w2,
+    ], q)
+
+# Cell
+def qmatrix(q):
+    """
+    Converts normalized quaternion(s) of shape (*, 4) to rotation
+    matrices of shape (*, 3, 3), so that qrot(q, v) == qmatrix(q) @ v.
+    A rotation of many vectors about one quaternion is then a single
+    matrix product, v @ qmatrix(q).T for row vectors.
+    """
+    assert q.shape[-1] == 4
+
+    w, x, y, z = (q[..., i] for i in range(4))
+    rows = [
+        _stack([1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)], q),
+        _stack([2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)], q),
+        _stack([2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)], q),
+    ]
+    return _stack(rows, q, axis=-2)
\ No newline at end of file
@@ -8,46 +8,51 @@ import copy
 
 import numpy as np
 
-from .camera import normalize_screen_coordinates
-from .mocap_dataset import MocapDataset
+from .camera import normalize_screen_coordinates, stack_miqus_cameras
+from .mocap_dataset import ActionData, MocapDataset, load_dataset
 from .skeleton import Skeleton
 
 # Cell
 class RunningposeDataset(MocapDataset):
     """Runningpose pose estimation dataset."""
-    def __init__(self, path):
-        super().__init__(fps=85, skeleton=runningpose_skeleton)
-        self.cameras = copy.deepcopy(runningpose_cameras_extrinsic_params)
+    def __init__(self, path, dtype='float32'):
+        super().__init__(fps=85, skeleton=runningpose_skeleton, dtype=dtype)
+        cameras = copy.deepcopy(runningpose_cameras_extrinsic_params)
+        # Focal lengths and centers in pixels, see stack_miqus_cameras.
+        pixels = stack_miqus_cameras(
+            runningpose_cameras_intrinsic_params, runningpose_cameras_extrinsic_params)
 
-        for cameras in self._cameras.values():
-            for i, cam in enumerate(cameras):
-                cam.update(runningpose_cameras_intrinsic_params[i])
-                for k, v in cam.items():
-                    if k not in ["id", "res_w", "res_h"]:
-                        cam[k] = np.array(v, dtype='float32')
+        for i, cam in enumerate(cameras):
+            cam.update(runningpose_cameras_intrinsic_params[i])
+            cam.update(focal_length=pixels['f'][i], center=pixels['c'][i])
+            for k, v in cam.items():
+                if k not in ["id", "res_w", "res_h"]:
+                    cam[k] = np.array(v, dtype=self._dtype)
 
-        # Normalize camera frame.
-        cam['center'] = normalize_screen_coordinates(
-            cam['center'], w=cam['res_w'], h=cam['res_h']).astype('float32')
-        cam['focal_length'] = cam['focal_length']/cam['res_w']*2
-        if 'translation' in cam:
-            cam['translation'] = cam['translation']/1000 # Milimeters to meters.
-        # Add intrinsic parameters vector.
-        cam['intrinsic'] = np.concatenate(
-            (cam['focal_length'], cam['center'],
-            cam['radial_distortion'], cam['tangential_distortion']))
+            # Normalize camera frame.
+            cam['center'] = normalize_screen_coordinates(
+                cam['center'], w=cam['res_w'], h=cam['res_h']).astype(self._dtype)
+            cam['focal_length'] = cam['focal_length']/cam['res_w']*2
+            if 'translation' in cam:
+                cam['translation'] = cam['translation']/1000 # Milimeters to meters.
+            # Add intrinsic parameters vector.
+            cam['intrinsic'] = np.concatenate(
+                (cam['focal_length'], cam['center'],
+                cam['radial_distortion'], cam['tangential_distortion']))
 
         # Load serialized dataset.
-        data = np.load(path, allow_pickle=True)['positions_3d'].item()
+        data = load_dataset(path, 'positions_3d')
 
+        # All subjects are recorded with the same cameras.
+        self._cameras = {subject: cameras for subject in data.keys()}
         self._data = {}
         for subject, actions in data.items():
             self._data[subject] = {}
             for action_name, positions in actions.items():
-                self._data[subject][action_name] = {
-                    'positions': positions,
-                    'cameras': self._cameras[subject],
-                }
+                self._data[subject][action_name] = ActionData(
+                    positions=positions, dtype=self._dtype,
+                    cameras=self._cameras[subject],
+                )
 
 # Cell
 runningpose_skeleton = Skeleton(
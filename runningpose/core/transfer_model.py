@@ -1,19 +1,18 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/20_transfer_model.ipynb (unless otherwise specified).
 
-__all__ = ['keypoints_3D', 'keypoints_3D', 'joints_left', 'joints_right', 'keypoints_2D', 'keypoints_2D_metadata',
+__all__ = ['keypoints_3D', 'joints_left', 'joints_right', 'keypoints_2D_path', 'keypoints_2D_metadata',
            'keypoints_2D_symmetry', 'kps_left', 'kps_right', 'keypoints_2D', 'keypoints_2D', 'subjects',
-           'subjects_extra_cut', 'subjects_cut', 'keypoints_3D_val', 'keypoints_3D_val', 'keypoints_2D_val',
-           'keypoints_2D_val', 'keypoints_2D_val', 'subjects', 'subjects_cut', 'shapes_3d', 'shapes_2d',
-           'poses_2d_train', 'poses_3d_train', 'poses_2d_val', 'poses_3d_val', 'checkpoint', 'allsub_keypoints',
-           'mean_keypoints', 'mean_keypoints', 'num_joints_in', 'in_features', 'num_joints_out', 'filter_widths',
-           'causal', 'dropout', 'channels', 'lr', 'lr_decay', 'batch_size', 'chunk_length', 'num_epochs',
-           'unfreeze_epoch', 'trigger_times', 'patience', 'model_run_train', 'model_run', 'receptive_field', 'pad',
-           'optimizer', 'scaler', 'losses_3d_train', 'losses_3d_train_eval', 'losses_3d_valid', 'initial_momentum',
-           'final_momentum', 'valid_generator', 'train_generator', 'train_generator_eval', 'epoch', 'chk_path',
-           'keypoints_3D_test', 'keypoints_3D_test', 'keypoints_2D_test', 'keypoints_2D_metadata',
-           'keypoints_2D_symmetry', 'kps_left', 'kps_right', 'keypoints_2D_test', 'keypoints_2D_test', 'subjects',
-           'subjects', 'poses_2d_test', 'poses_3d_test', 'checkpoint', 'model_run', 'testing_generator',
-           'losses_3d_test']
+           'subjects_extra_cut', 'subjects_cut', 'keypoints_3D_val', 'keypoints_2D_val', 'keypoints_2D_val', 'subjects',
+           'subjects_cut', 'shapes_3d', 'shapes_2d', 'poses_2d_train', 'poses_3d_train', 'poses_2d_val', 'poses_3d_val',
+           'checkpoint', 'allsub_keypoints', 'mean_keypoints', 'mean_keypoints', 'num_joints_in', 'in_features',
+           'num_joints_out', 'filter_widths', 'causal', 'dropout', 'channels', 'lr', 'lr_decay', 'batch_size',
+           'chunk_length', 'num_epochs', 'unfreeze_epoch', 'trigger_times', 'patience', 'model_run_train', 'model_run',
+           'receptive_field', 'pad', 'optimizer', 'scaler', 'losses_3d_train', 'losses_3d_train_eval',
+           'losses_3d_valid', 'initial_momentum', 'final_momentum', 'valid_generator', 'train_generator',
+           'train_prefetcher', 'train_generator_eval', 'epoch', 'chk_path', 'keypoints_3D_test',
+           'keypoints_2D_test_path', 'keypoints_2D_metadata', 'keypoints_2D_symmetry', 'kps_left', 'kps_right',
+           'keypoints_2D_test', 'keypoints_2D_test', 'subjects', 'subjects', 'poses_2d_test', 'poses_3d_test',
+           'checkpoint', 'model_run', 'testing_generator', 'losses_3d_test']
 
 # Cell
 import os
@@ -28,15 +27,15 @@ import matplotlib.pyplot as plt
 import torch.optim as optim
 import torch.nn as nn
 
-from .generators import ChunkedGenerator, UnchunkedGenerator
+from .generators import ChunkedGenerator, UnchunkedGenerator, PrefetchGenerator
 from .loss import mpjpe
-from .model import TemporalModel
+from .model import TemporalModel, TemporalModelOptimized1f
 from .camera import normalize_screen_coordinates
+from .mocap_dataset import load_dataset
 
 # Cell
 print('Loading training dataset...')
-keypoints_3D = np.load('data_files/data_3d_train.npz', allow_pickle=True)
-keypoints_3D = keypoints_3D['positions_3d'].item()
+keypoints_3D = load_dataset('data_files/data_3d_train.npz', 'positions_3d')
 joints_left = [3, 6, 7, 10, 12, 14, 16]
 joints_right = [4, 8, 9, 11, 13, 15, 17]
 print(keypoints_3D.keys())
@@ -44,12 +43,12 @@ print(keypoints_3D['Ioanna3_Camera1_170Hz_3D_keypoints'].shape)
 
 # Cell
 print('Loading 2D training detections...')
-keypoints_2D = np.load('data_files/data_2d_custom_trainingdata.npz', allow_pickle=True)
-keypoints_2D_metadata = keypoints_2D['metadata'].item()
+keypoints_2D_path = 'data_files/data_2d_custom_trainingdata.npz'
+keypoints_2D_metadata = load_dataset(keypoints_2D_path, 'metadata')
 keypoints_2D_symmetry = keypoints_2D_metadata['keypoints_symmetry']
 kps_left = list(keypoints_2D_symmetry[0])
 kps_right = list(keypoints_2D_symmetry[1])
-keypoints_2D = keypoints_2D['positions_2d'].item()
+keypoints_2D = load_dataset(keypoints_2D_path, 'positions_2d')
 keypoints_2D = dict(sorted(keypoints_2D.items()))
 print(keypoints_2D.keys())
 print(keypoints_2D['miqus1_Ioanna_01.avi']['custom'][0].shape)
@@ -57,7 +56,7 @@ print(keypoints_2D['miqus1_Ioanna_01.avi']['custom'][0].shape)
 # Cell
 # Converts all training data to meters
 for subject in keypoints_3D.keys():
-    keypoints_3D[subject] /= 1000
+    keypoints_3D[subject] = keypoints_3D[subject] / 1000
 
 # Cell
 # Normalize camera frame
@@ -96,22 +95,20 @@ for subject in subjects_cut:
 
 # Cell
 print('Loading validation dataset...')
-keypoints_3D_val = np.load('data_files/data_3d_val.npz', allow_pickle=True)
-keypoints_3D_val = keypoints_3D_val['positions_3d'].item()
+keypoints_3D_val = load_dataset('data_files/data_3d_val.npz', 'positions_3d')
 print(keypoints_3D_val.keys())
 # print(keypoints_3D['Ioanna1_Camera1_170Hz_3D_keypoints'].shape)
 
 # Cell
 print('Loading 2D training detections...')
-keypoints_2D_val = np.load('data_files/data_2d_custom_validationdata.npz', allow_pickle=True)
-keypoints_2D_val = keypoints_2D_val['positions_2d'].item()
+keypoints_2D_val = load_dataset('data_files/data_2d_custom_validationdata.npz', 'positions_2d')
 keypoints_2D_val = dict(sorted(keypoints_2D_val.items()))
 print(keypoints_2D_val.keys())
 
 # Cell
 # Converts all 3D validation data to meters
 for subject in keypoints_3D_val.keys():
-    keypoints_3D_val[subject] /= 1000
+    keypoints_3D_val[subject] = keypoints_3D_val[subject] / 1000
 
 # Cell
 subjects = [
@@ -121,6 +118,7 @@ subjects = [
 for subject in subjects:
     for action in keypoints_2D_val[subject]:
         for idx, kps in enumerate(keypoints_2D_val[subject][action]):
+            kps = np.require(kps, requirements='W') # Store arrays are read-only.
             kps[..., :2] = normalize_screen_coordinates(kps[..., :2], w=1920, h=1088)
             keypoints_2D_val[subject][action][idx] = kps
 
@@ -132,6 +130,7 @@ subjects_cut = [
 for subject in subjects_cut:
     for action in keypoints_2D_val[subject]:
         for idx, kps in enumerate(keypoints_2D_val[subject][action]):
+            kps = np.require(kps, requirements='W') # Store arrays are read-only.
             kps[..., :2] = normalize_screen_coordinates(kps[..., :2], w=1480, h=1088)
             keypoints_2D_val[subject][action][idx] = kps
 
@@ -225,8 +224,10 @@ unfreeze_epoch = 4
 trigger_times = 0
 patience = 6000 #################NOTE: Turned off
 
-# Load two models one for training and one for evaluation
-model_run_train = TemporalModel(
+# Load two models one for training and one for evaluation.
+# Since chunk_length is 1 the training model can use strided convolutions,
+# its weights are interchangeable with the evaluation model.
+model_run_train = TemporalModelOptimized1f(
     num_joints_in, in_features, num_joints_out, filter_widths, causal,
     dropout, channels
 )
@@ -283,8 +284,9 @@ train_generator = ChunkedGenerator(
     batch_size, cameras=None, poses_3d=poses_3d_train, poses_2d=poses_2d_train,
     pad=pad, chunk_length=chunk_length, shuffle=True, augment=True,
     kps_left=kps_left, kps_right=kps_right,
-    joints_left=joints_left, joints_right=joints_right
+    joints_left=joints_left, joints_right=joints_right, prepad=True
 )
+train_prefetcher = PrefetchGenerator(train_generator, num_workers=2)
 train_generator_eval = UnchunkedGenerator(
     cameras=None, poses_3d=poses_3d_train, poses_2d=poses_2d_train,
     pad=pad, augment=False
@@ -307,9 +309,7 @@ while epoch < num_epochs:
     epoch_loss_2d_train_unlabeled = 0
     N = 0
     # Regular supervised scenario
-    for _, batch_3d, batch_2d in train_generator.next_epoch():
-        inputs_3d = torch.from_numpy(batch_3d.astype('float32'))
-        inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
+    for _, inputs_3d, inputs_2d in train_prefetcher.next_epoch():
         if torch.cuda.is_available():
             inputs_3d = inputs_3d.cuda()
             inputs_2d = inputs_2d.cuda()
@@ -343,8 +343,8 @@ while epoch < num_epochs:
 
         # Evaluate on validation dataset
         for _, batch_3d, batch_2d in valid_generator.next_epoch():
-            inputs_3d_valid = torch.from_numpy(batch_3d.astype('float32'))
-            inputs_2d_valid = torch.from_numpy(batch_2d.astype('float32'))
+            inputs_3d_valid = torch.from_numpy(batch_3d)
+            inputs_2d_valid = torch.from_numpy(batch_2d)
             if torch.cuda.is_available():
                 inputs_3d_valid = inputs_3d_valid.cuda()
                 inputs_2d_valid = inputs_2d_valid.cuda()
@@ -377,8 +377,8 @@ while epoch < num_epochs:
                 # This can only happen when downsampling the dataset
                 continue
 
-            inputs_3d = torch.from_numpy(batch_3d.astype('float32'))
-            inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
+            inputs_3d = torch.from_numpy(batch_3d)
+            inputs_2d = torch.from_numpy(batch_2d)
             if torch.cuda.is_available():
                 inputs_3d = inputs_3d.cuda()
                 inputs_2d = inputs_2d.cuda()
@@ -454,18 +454,17 @@ torch.save({
 }, chk_path)
 
 # Cell
-keypoints_3D_test = np.load('data_files/data_3d_test.npz', allow_pickle=True)
-keypoints_3D_test = keypoints_3D_test['positions_3d'].item()
+keypoints_3D_test = load_dataset('data_files/data_3d_test.npz', 'positions_3d')
 keypoints_3D_test.keys()
 
 # Cell
 print('Loading 2D training detections...')
-keypoints_2D_test = np.load('data_2d_custom_testdata.npz', allow_pickle=True)
-keypoints_2D_metadata = keypoints_2D_test['metadata'].item()
+keypoints_2D_test_path = 'data_2d_custom_testdata.npz'
+keypoints_2D_metadata = load_dataset(keypoints_2D_test_path, 'metadata')
 keypoints_2D_symmetry = keypoints_2D_metadata['keypoints_symmetry']
 kps_left = list(keypoints_2D_symmetry[0])
 kps_right = list(keypoints_2D_symmetry[1])
-keypoints_2D_test = keypoints_2D_test['positions_2d'].item()
+keypoints_2D_test = load_dataset(keypoints_2D_test_path, 'positions_2d')
 keypoints_2D_test = dict(sorted(keypoints_2D_test.items()))
 print(keypoints_2D_test.keys())
 
@@ -477,7 +476,7 @@ keypoints_3D_test['Anna2_Camera3_170Hz_3D_keypoints'] = keypoints_3D_test['Anna2
 # Cell
 # Scale the data
 for subject in keypoints_3D_test.keys():
-    keypoints_3D_test[subject] /= 1000
+    keypoints_3D_test[subject] = keypoints_3D_test[subject] / 1000
 
 for subject in keypoints_3D_test.keys():
     for i in range(keypoints_3D_test[subject].shape[0]):
@@ -487,6 +486,7 @@ subjects = ['Anna_Miqus_14.avi', 'Anna_Miqus_15.avi']
 for subject in subjects:
     for action in keypoints_2D_test[subject]:
         for idx, kps in enumerate(keypoints_2D_test[subject][action]):
+            kps = np.require(kps, requirements='W') # Store arrays are read-only.
             kps[..., :2] = normalize_screen_coordinates(kps[..., :2], w=1920, h=1088)
             keypoints_2D_test[subject][action][idx] = kps
 
@@ -494,6 +494,7 @@ subjects = ['Anna_Miqus_16.avi']
 for subject in subjects:
     for action in keypoints_2D_test[subject]:
         for idx, kps in enumerate(keypoints_2D_test[subject][action]):
+            kps = np.require(kps, requirements='W') # Store arrays are read-only.
             kps[..., :2] = normalize_screen_coordinates(kps[..., :2], w=1480, h=1088)
             keypoints_2D_test[subject][action][idx] = kps
 
@@ -542,8 +543,8 @@ with torch.no_grad():
     epoch_loss_3d_test = 0
     N = 0
     for _, batch_3d, batch2d in testing_generator.next_epoch():
-        inputs_2d_test = torch.from_numpy(batch2d.astype('float32'))
-        inputs_3d_test = torch.from_numpy(batch_3d.astype('float32'))
+        inputs_2d_test = torch.from_numpy(batch2d)
+        inputs_3d_test = torch.from_numpy(batch_3d)
         if torch.cuda.is_available():
             inputs_2d_test = inputs_2d_test.cuda()
             inputs_3d_test = inputs_3d_test.cuda()
@@ -0,0 +1,83 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: nbs/22_triangulation.ipynb (unless otherwise specified).
+
+__all__ = ['load_custom_views', 'triangulate_points']
+
+# Cell
+import numpy as np
+
+from .camera import undistort_points
+from .mocap_dataset import load_dataset
+
+# Cell
+def load_custom_views(path, video_names):
+    """
+    Loads the 2D keypoints of the synchronized videos of each camera
+    from a prepare_data_2d_custom output file, or its converted store. The videos are cut to
+    the length of the shortest one.
+
+    Arguments:
+    path -- Path to a data_2d_custom_*.npz file.
+    video_names -- The video name of each camera, in the order of the cameras.
+
+    Returns a (C, frames, joints, 2) array of keypoints in pixel space.
+    """
+    positions_2d = load_dataset(path, 'positions_2d')
+    views = [positions_2d[name]['custom'][0] for name in video_names]
+    num_frames = min(len(view) for view in views)
+    return np.stack([view[:num_frames] for view in views])
+
+# Cell
+def triangulate_points(
+        points_2d, cameras, confidence=None, undistort=True, iterations=5):
+    """
+    Triangulates points seen by several cameras with confidence-weighted
+    linear least squares (DLT), for all frames and joints at once.
+
+    Arguments:
+    points_2d -- (C, *, 2) points in pixel space, e.g. (C, frames, joints, 2),
+        where missing detections can be NaN.
+    cameras -- Stacked camera parameters, see stack_miqus_cameras.
+    confidence -- (C, *) weight of each point, or None to weight all
+        views the same. Views with a weight of 0 are ignored.
+    undistort -- Removes the lens distortion before triangulating.
+    iterations -- Number of iterations of undistort_points.
+
+    Returns (*, 3) points in world coordinates, in the units of the
+    camera translations. Points seen by less than two cameras are NaN.
+    """
+    assert points_2d.shape[-1] == 2
+    assert len(points_2d.shape) >= 3
+
+    points_2d = np.asarray(points_2d, dtype='float64')
+    if confidence is None:
+        confidence = np.ones(points_2d.shape[:-1])
+    detected = np.isfinite(points_2d).all(-1)
+    weights = np.where(detected, confidence, 0)
+    points_2d = np.where(detected[..., None], points_2d, 0)
+
+    def expand(param, n_trailing):
+        # Broadcasts a camera parameter over the point dimensions.
+        n_points = len(points_2d.shape) - 2
+        return param.reshape(
+            param.shape[:1] + (1,)*n_points + param.shape[1:][-n_trailing:])
+
+    if undistort:
+        xy = undistort_points(points_2d, cameras, iterations)
+    else:
+        xy = (points_2d - expand(cameras['c'], 1)) / expand(cameras['f'], 1)
+
+    # Each view gives two equations (x*r3 - r1).(P - T) = 0 and
+    # (y*r3 - r2).(P - T) = 0, where r1, r2, r3 are the rows of R.
+    R = expand(cameras['R'], 2)
+    T = expand(cameras['T'], 1)[..., None]
+    A = xy[..., None]*R[..., 2:, :] - R[..., :2, :]
+    AtA = weights[..., None, None] * (A.swapaxes(-1, -2) @ A)
+
+    # Solves the weighted normal equations of all views.
+    M = AtA.sum(0)
+    b = (AtA @ T).sum(0)[..., 0]
+    valid = (weights > 0).sum(0) >= 2
+    M[~valid] = np.eye(3)
+    P = np.linalg.solve(M, b[..., None])[..., 0]
+    P[~valid] = np.nan
+    return P
\ No newline at end of file
@@ -1,9 +1,13 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/07_utils.ipynb (unless otherwise specified).
 
-__all__ = ['wrap', 'deterministic_random']
+__all__ = ['wrap', 'deterministic_random', 'hash_inputs', 'save_array_tree', 'load_array_tree']
 
 # Cell
 import hashlib
+import json
+import os
+import shutil
+import tempfile
 
 import numpy as np
 import torch
@@ -49,4 +53,109 @@ def deterministic_random(min_value, max_value, data):
     """
     digest = hashlib.sha256(data.encode()).digest()
     raw_value = int.from_bytes(digest[:4], byteorder='little', signed=False)
-    return int(raw_value / (2**32 - 1) * (max_value - min_value)) + min_value
\ No newline at end of file
+    return int(raw_value / (2**32 - 1) * (max_value - min_value)) + min_value
+
+# Cell
+def hash_inputs(paths, **params):
+    """
+    Returns a hash of the contents of the files and of the parameters,
+    to name cached results that depend on them. A directory is hashed
+    with all the files in it. Parameters may hold arrays, e.g. camera
+    calibrations.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                files.extend(sorted(os.path.join(root, name) for name in names))
+        else:
+            files.append(path)
+
+    digest = hashlib.sha256()
+    for path in files:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True, default=lambda x: np.asarray(x).tolist()).encode())
+    return digest.hexdigest()[:16]
+
+# Cell
+def save_array_tree(directory, tree, overwrite=False):
+    """
+    Saves nested dicts and lists of arrays, e.g. the positions of each
+    subject, action and camera, as one .npy file per array and an
+    index.json with the rest of the tree. The directory is written
+    under a temporary name and renamed when complete. Dicts with other
+    than string keys are saved as key-value pairs and tuples are
+    tagged, so that they keep their types through JSON.
+
+    An existing directory raises FileExistsError, unless overwrite is
+    set, then the old directory is swapped for the new one and deleted.
+    """
+    def encode(node):
+        if isinstance(node, dict):
+            if all(isinstance(key, str) for key in node):
+                return {'dict': {key: encode(value) for key, value in node.items()}}
+            return {'items': [[encode(key), encode(value)] for key, value in node.items()]}
+        if isinstance(node, tuple):
+            return {'tuple': [encode(value) for value in node]}
+        if isinstance(node, list):
+            return {'list': [encode(value) for value in node]}
+        if isinstance(node, np.ndarray):
+            name = '{:05d}.npy'.format(len(files))
+            files.append(name)
+            np.save(os.path.join(tmp, name), node)
+            return {'npy': name}
+        if isinstance(node, np.generic):
+            return {'value': node.item()}
+        return {'value': node}
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent)
+    files = []
+    try:
+        with open(os.path.join(tmp, 'index.json'), 'w') as f:
+            json.dump(encode(tree), f)
+        try:
+            os.rename(tmp, directory)
+            return
+        except OSError:
+            # The directory exists, or another process has just saved it.
+            if not os.path.isdir(directory):
+                raise
+        if not overwrite:
+            raise FileExistsError('{} already exists, pass overwrite=True to replace it.'.format(directory))
+        old = tmp + '.old'
+        os.rename(directory, old)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            os.rename(old, directory)
+            raise
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    # Arrays of the old tree that are memory-mapped stay readable.
+    shutil.rmtree(old)
+
+def load_array_tree(directory, mmap_mode='r'):
+    """
+    Loads a tree saved with save_array_tree. The arrays are memory-mapped
+    by default, so they are only read from disk when used.
+    """
+    def decode(node):
+        if 'dict' in node:
+            return {key: decode(value) for key, value in node['dict'].items()}
+        if 'items' in node:
+            return {decode(key): decode(value) for key, value in node['items']}
+        if 'tuple' in node:
+            return tuple(decode(value) for value in node['tuple'])
+        if 'list' in node:
+            return [decode(value) for value in node['list']]
+        if 'npy' in node:
+            return np.load(os.path.join(directory, node['npy']), mmap_mode=mmap_mode)
+        return node['value']
+
+    with open(os.path.join(directory, 'index.json')) as f:
+        return decode(json.load(f))
\ No newline at end of file
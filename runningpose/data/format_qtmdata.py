@@ -1,10 +1,14 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/17_format_qtmdata.ipynb (unless otherwise specified).
 
-__all__ = ['parse_args', 'main']
+__all__ = ['parse_args', 'qtm_unused_markers', 'qtm_midpoint_keypoints', 'keypoint_table', 'convert_qtmdata',
+           'output_name', 'convert_to_npy', 'convert_directory', 'main']
 
 # Cell
 import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from itertools import repeat
 
 import numpy as np
 import pandas as pd
@@ -20,6 +24,25 @@ def parse_args():
         help='qtm text file that has been formated in matlab',
         type=str
     )
+    parser.add_argument(
+        '--data-dir',
+        dest='data_dir',
+        help='directory of qtm text files to convert in parallel to .npy files',
+        type=str
+    )
+    parser.add_argument(
+        '--labels',
+        dest='labels',
+        help='marker labels of the qtm text files (default: qtm_labels.txt)',
+        default='qtm_labels.txt',
+        type=str
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        help='number of processes converting files in --data-dir mode',
+        type=int
+    )
     parser.add_argument(
         '--output-dir',
         dest='output_dir',
@@ -84,87 +107,130 @@ def parse_args():
 #     # TODO: Check Proj format correctly restructured
 #     return data_2D
 
+# Cell
+# Markers that are not used as keypoints.
+qtm_unused_markers = [
+    'HeadL', 'HeadR', 'Chest', 'LThighFrontLow', 'RThighFrontLow',
+    'LShinFrontHigh', 'RShinFrontHigh', 'LForefoot5', 'RForefoot5',
+    'LHeelBack', 'RHeelBack', 'LArm', 'RArm','WaistLFront', 'WaistL',
+    'WaistRFront', 'WaistR', 'LHand2', 'RHand2'
+]
+
+# Keypoints in the middle of two markers, added after the other keypoints.
+qtm_midpoint_keypoints = {
+    'LElbow': ['LElbowOut','LElbowIn'],
+    'RElbow': ['RElbowOut','RElbowIn'],
+    'LWrist': ['LWristIn','LWristOut'],
+    'RWrist': ['RWristOut','RWristIn'],
+    'LKnee': ['LKneeOut','LKneeIn'],
+    'RKnee': ['RKneeOut','RKneeIn'],
+    'LAnkle': ['LAnkleOut','LAnkleIn'],
+    'RAnkle': ['RAnkleOut','RAnkleIn'],
+}
+
+# Cell
+def keypoint_table(labels):
+    """
+    Maps the markers of a qtm text file to keypoints. The markers that
+    are neither unused nor part of a midpoint are kept as they are.
+
+    Returns the keypoint names and a (keypoints, markers) matrix with
+    ones for the markers that are averaged into each keypoint.
+    """
+    labels = list(labels)
+    midpoint_markers = sum(qtm_midpoint_keypoints.values(), [])
+    kept = [
+        label for label in labels
+        if label not in qtm_unused_markers and label not in midpoint_markers
+    ]
+    names = kept + list(qtm_midpoint_keypoints)
+    markers = [[label] for label in kept] + list(qtm_midpoint_keypoints.values())
+
+    table = np.zeros((len(names), len(labels)))
+    for i, keypoint_markers in enumerate(markers):
+        for marker in keypoint_markers:
+            table[i, labels.index(marker)] = 1
+    return names, table
+
+def convert_qtmdata(data_3D, table, decimation=2):
+    """
+    Converts qtm data, one row of x, y, z per frame for each marker, to
+    keypoints of shape (frames, keypoints, 3). Only every decimation:th
+    frame is kept, the Miqus video is 85 Hz and the data 170 Hz.
+    Missing markers are left out of the means.
+    """
+    markers = data_3D.reshape(len(data_3D), -1, 3)[:, ::decimation]
+    valid = np.isfinite(markers)
+    # All keypoints as one matrix product over the markers.
+    total = table @ np.where(valid, markers, 0).reshape(len(markers), -1)
+    count = table @ valid.reshape(len(markers), -1)
+    with np.errstate(invalid='ignore'):
+        keypoints = total / count
+    return keypoints.reshape(len(table), -1, 3).transpose(1, 0, 2)
+
+def output_name(data_file):
+    """Returns the name of the output files of a qtm text file."""
+    data_file_name = os.path.basename(
+        os.path.normpath(data_file)).rsplit(".")[0]
+    return data_file_name + '_3D_keypoints'
+
+# Cell
+def convert_to_npy(data_file, labels, output_dir, decimation=2):
+    """
+    Converts a qtm text file to a float32 .npy file with the keypoints
+    of shape (frames, keypoints, 3). Returns the path of the file.
+    """
+    _, table = keypoint_table(labels)
+    data_3D = np.loadtxt(data_file, dtype='float', delimiter=',')
+    keypoints = convert_qtmdata(data_3D, table, decimation)
+    out_3D = os.path.join(output_dir, output_name(data_file) + '.npy')
+    np.save(out_3D, keypoints.astype('float32'))
+    return out_3D
+
+def convert_directory(data_dir, labels, output_dir, workers=None):
+    """
+    Converts all qtm text files in a directory to .npy files, with one
+    process per file. Label files in the directory are skipped.
+    """
+    data_files = [
+        f for f in sorted(glob(os.path.join(data_dir, '*.txt')))
+        if not f.endswith('labels.txt')
+    ]
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(workers) as executor:
+        for out_3D in executor.map(
+                convert_to_npy, data_files, repeat(labels), repeat(output_dir)):
+            print('Saved {}'.format(out_3D))
+
 # Cell
 def main(args):
     """
     Loads the qtm data then removes unwanted keypoints.
     Then it infers new keypoints adds them.
     """
-    # Loads the textfiles
-    labels_np = np.loadtxt('qtm_labels.txt', dtype = 'str')
-    data_3D = np.loadtxt(args.data_file, dtype = 'float', delimiter= ',')
+    # Loads the labels of the markers
+    labels_np = np.loadtxt(args.labels, dtype = 'str')
+    if args.data_dir:
+        convert_directory(args.data_dir, labels_np, args.output_dir, args.workers)
+        return
 
-    # Reformats the data to a dataframe
-    data_3D = pd.DataFrame(data_3D, index=labels_np).T
-
-    # Remove unwanted keypoints
-    data_3D = data_3D.drop(
-        columns=[
-            'HeadL', 'HeadR', 'Chest', 'LThighFrontLow', 'RThighFrontLow',
-            'LShinFrontHigh', 'RShinFrontHigh', 'LForefoot5', 'RForefoot5',
-            'LHeelBack', 'RHeelBack', 'LArm', 'RArm','WaistLFront', 'WaistL',
-            'WaistRFront', 'WaistR', 'LHand2', 'RHand2'
-        ]
-    )
-    # Create "new" keypoints by finding the mean between specific keypoints
-    left_elbow_3D = data_3D.loc[:, ['LElbowOut','LElbowIn']].mean(axis=1)
-    right_elbow_3D = data_3D.loc[:, ['RElbowOut','RElbowIn']].mean(axis=1)
-
-    left_wrist_3D = data_3D.loc[:, ['LWristIn','LWristOut']].mean(axis=1)
-    right_wrist_3D = data_3D.loc[:, ['RWristOut','RWristIn']].mean(axis=1)
-
-    left_knee_3D = data_3D.loc[:, ['LKneeOut','LKneeIn']].mean(axis=1)
-    right_knee_3D = data_3D.loc[:, ['RKneeOut','RKneeIn']].mean(axis=1)
-
-    left_ankle_3D = data_3D.loc[:, ['LAnkleOut','LAnkleIn']].mean(axis=1)
-    right_ankle_3D = data_3D.loc[:, ['RAnkleOut','RAnkleIn']].mean(axis=1)
-
-    # Remove the keypoints that was taken as a mean
-    data_3D = data_3D.drop(
-        columns=[
-            'LElbowOut','LElbowIn', 'RElbowOut','RElbowIn',
-            'LWristIn','LWristOut', 'RWristIn','RWristOut',
-            'LKneeIn', 'LKneeOut','RKneeIn', 'RKneeOut',
-            'LAnkleOut','LAnkleIn','RAnkleOut','RAnkleIn'
-        ]
-    )
-    # Adds the new keypoint data to the dataframe
-    data_3D['LElbow'] = left_elbow_3D
-    data_3D['RElbow'] = right_elbow_3D
-    data_3D['LWrist'] = left_wrist_3D
-    data_3D['RWrist'] = right_wrist_3D
-    data_3D['LKnee'] = left_knee_3D
-    data_3D['RKnee'] = right_knee_3D
-    data_3D['LAnkle'] = left_ankle_3D
-    data_3D['RAnkle'] = right_ankle_3D
-
-    # Remove every other frame, our videodata Miqus is 85hz and the data is 170hz
-    # OBS! (3 rows corresponds to 1 frame.)
-    remove = True
-    for i in range(0, data_3D.shape[0]):
-        if i % 3 == 0:
-            remove = not(remove)
-
-        if remove:
-            data_3D = data_3D.drop(i)
-
-    data_3D = data_3D.reset_index(drop=True)
+    data_3D = np.loadtxt(args.data_file, dtype = 'float', delimiter= ',')
+    names, table = keypoint_table(labels_np)
+    keypoints = convert_qtmdata(data_3D, table)
 
     # Convert 3D world to 2D camera coordinates
     # data_2D = convert_to_2D(data_3D, args.camera-1) # args.camera-1 for cameras (0,1,2) instead of (1,2,3)
 
     # Creates output names that depends on the name of the data file
-    data_file_name = os.path.basename(
-        os.path.normpath(args.data_file)).rsplit(".")[0]
     # out_2D = os.path.join(
-    #     args.output_dir, data_file_name + '_2D_keypoints.csv')
-    out_3D = os.path.join(
-        args.output_dir, data_file_name + '_3D_keypoints.csv')
+    #     args.output_dir, output_name(args.data_file) + '_2D_keypoints.csv')
+    out_3D = os.path.join(args.output_dir, output_name(args.data_file) + '.csv')
 
-    # Save the keypoint data as csv files
+    # Save the keypoint data as csv files, 3 rows per frame (x, y, z)
     # TODO: Add reformat to 2D data i.e 3DWorld -> 3DCamera -> 2D (projection)
     # pd.DataFrame.to_csv(data_2D, path_or_buf=out_2D)
-    # TODO: Check if it is better to save this as npz instead.
+    data_3D = pd.DataFrame(
+        keypoints.transpose(0, 2, 1).reshape(-1, len(names)), columns=names)
     pd.DataFrame.to_csv(data_3D, path_or_buf=out_3D)
     # pd.DataFrame.to_csv(data_2D, path_or_buf=out_2D)
 
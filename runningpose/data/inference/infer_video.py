@@ -1,20 +1,33 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/14_infer_video.ipynb (unless otherwise specified).
 
-__all__ = ['parse_args', 'get_resolution', 'read_video', 'main']
+__all__ = ['parse_args', 'get_resolution', 'read_video', 'batched', 'BatchPredictor', 'RoiTracker', 'to_full_frame',
+           'KeyframePropagator', 'MotionGate', 'format_outputs', 'PipelineStopped', 'Stage', 'read_stage',
+           'detect_stage', 'write_stage', 'process_video', 'utilisation_report', 'file_hash', 'save_atomic',
+           'load_manifest', 'save_manifest', 'is_processed', 'build_predictor', 'init_worker', 'process_worker', 'main']
 
 # Cell
 import argparse
+import copy
 import glob
+import hashlib
+import json
 import os
+import queue
 import subprocess as sp
 import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
 
 import detectron2
+import detectron2.data.transforms as T
 import numpy as np
+import torch
 from detectron2 import model_zoo
 from detectron2.config import get_cfg
 from detectron2.engine import DefaultPredictor
+from detectron2.structures import Boxes, Instances
 from detectron2.utils.logger import setup_logger
 
 # Cell
@@ -41,6 +54,81 @@ def parse_args():
         default='mp4',
         type=str
     )
+    parser.add_argument(
+        '--batch-size',
+        dest='batch_size',
+        help='number of frames per forward pass (default: 1)',
+        default=1,
+        type=int
+    )
+    parser.add_argument(
+        '--threads',
+        dest='threads',
+        help='number of torch threads (default: torch default)',
+        default=None,
+        type=int
+    )
+    parser.add_argument(
+        '--queue-size',
+        dest='queue_size',
+        help='number of batches waiting between the pipeline stages (default: 4)',
+        default=4,
+        type=int
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        help='number of videos processed in parallel, each with its own predictor (default: 1)',
+        default=1,
+        type=int
+    )
+    parser.add_argument(
+        '--track',
+        dest='track',
+        help='detect on a crop around the runner of the previous frame',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--track-size',
+        dest='track_size',
+        help='shortest edge of the resized crops when tracking (default: 400)',
+        default=400,
+        type=int
+    )
+    parser.add_argument(
+        '--keyframe-interval',
+        dest='keyframe_interval',
+        help='detect every K:th frame and propagate the keypoints in between (default: 1)',
+        default=1,
+        type=int
+    )
+    parser.add_argument(
+        '--max-drift',
+        dest='max_drift',
+        help='grey level change (0-1) in the box that forces a detection (default: 0.1)',
+        default=0.1,
+        type=float
+    )
+    parser.add_argument(
+        '--motion-gate',
+        dest='motion_gate',
+        help='skip the detector on frames without motion',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--motion-threshold',
+        dest='motion_threshold',
+        help='grey level difference (0-255) of a moving pixel (default: 25)',
+        default=25,
+        type=float
+    )
+    parser.add_argument(
+        '--motion-fraction',
+        dest='motion_fraction',
+        help='fraction of moving pixels that counts as motion (default: 0.001)',
+        default=0.001,
+        type=float
+    )
     parser.add_argument(
         'im_or_folder', help='image or folder of images', default=None
     )
@@ -57,9 +145,14 @@ def get_resolution(filename):
         '-show_entries', 'stream=width,height', '-of', 'csv=p=0', filename
     ]
     pipe = sp.Popen(command, stdout=sp.PIPE, bufsize=-1)
-    for line in pipe.stdout:
-        w, h = line.decode().strip().split(',')
-        return int(w), int(h)
+    try:
+        for line in pipe.stdout:
+            w, h = line.decode().strip().split(',')
+            return int(w), int(h)
+    finally:
+        pipe.stdout.close()
+        pipe.kill()
+        pipe.wait()
 
 # Cell
 def read_video(filename):
@@ -77,82 +170,764 @@ def read_video(filename):
     ]
 
     pipe = sp.Popen(command, stdout=sp.PIPE, bufsize=-1)
+    try:
+        while True:
+            data = pipe.stdout.read(w*h*3)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype='uint8').reshape((h, w, 3))
+    finally:
+        # Also stops ffmpeg when the generator is closed early.
+        pipe.stdout.close()
+        pipe.kill()
+        pipe.wait()
+
+# Cell
+def batched(iterable, size):
+    """Yields lists of size items from the iterable, the last one may be shorter."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# Cell
+class BatchPredictor(DefaultPredictor):
+    """
+    A DefaultPredictor that can run the model on several frames per forward pass.
+    Calling it with a single image works as before.
+
+    The resize transform only depends on the image size, so it is computed
+    once per resolution and the float conversion is done for the whole batch.
+    The resizing itself is done per frame with the same transform as
+    DefaultPredictor, which keeps the predictions identical.
+    """
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.transforms = {}
+
+    def get_transform(self, image):
+        """Returns the (cached) resize transform for the size of the image."""
+        shape = image.shape[:2]
+        if shape not in self.transforms:
+            self.transforms[shape] = self.aug.get_transform(image)
+        return self.transforms[shape]
+
+    def predict_batch(self, original_images):
+        """
+        Runs the model on a list of BGR images of the same size and
+        returns a list with the predictions of each image.
+        """
+        with torch.no_grad():
+            images = np.stack(original_images)
+            if self.input_format == 'RGB':
+                images = images[..., ::-1]
+            height, width = images.shape[1:3]
+            transform = self.get_transform(images[0])
+            images = np.stack([transform.apply_image(image) for image in images])
+            images = torch.as_tensor(images.astype('float32').transpose(0, 3, 1, 2))
+            inputs = [
+                {'image': image, 'height': height, 'width': width}
+                for image in images
+            ]
+            return self.model(inputs)
+
+# Cell
+class RoiTracker:
+    """
+    Runs the detector on a crop around the runner instead of the full frame.
+    After a confident detection the next frame is cropped to the last
+    boundary box expanded around its center, detected at a lower resolution
+    and the predictions are mapped back to full-frame coordinates.
+    When the best person in the crop is not confident enough, or is cut by
+    the crop, the frame is detected again on the full frame.
+
+    Arguments:
+    predictor -- The DefaultPredictor (or BatchPredictor) for full frames.
+    crop_size -- Length the shortest edge of a crop is resized to.
+    expand -- The crop is the last boundary box scaled by this factor.
+    min_score -- Score a person needs to be tracked.
+    """
+
+    def __init__(self, predictor, crop_size=400, expand=1.5, min_score=0.9):
+        self.predictor = predictor
+        self.crop_predictor = copy.copy(predictor)
+        self.crop_predictor.aug = T.ResizeShortestEdge(
+            [crop_size, crop_size], predictor.cfg.INPUT.MAX_SIZE_TEST)
+        # BatchPredictor caches its transforms per resolution.
+        self.crop_predictor.transforms = {}
+        self.expand = expand
+        self.min_score = min_score
+        self.box = None
+        self.crops = 0
+        self.full_frames = 0
+
+    def crop_box(self, shape):
+        """Returns the crop (x0, y0, x1, y1) around the last boundary box."""
+        h, w = shape[:2]
+        center = (self.box[:2] + self.box[2:]) / 2
+        size = (self.box[2:] - self.box[:2]) * self.expand
+        x0, y0 = np.maximum(np.floor(center - size/2), 0).astype(int)
+        x1, y1 = np.minimum(np.ceil(center + size/2), [w, h]).astype(int)
+        return x0, y0, x1, y1
+
+    def track(self, instances, shape, crop=None):
+        """
+        Returns the boundary box of the most confident person if it can be
+        tracked, otherwise None.
+        """
+        if instances.has('pred_classes'):
+            instances = instances[instances.pred_classes == 0]
+        if len(instances) == 0:
+            return None
+        best = int(instances.scores.argmax())
+        if float(instances.scores[best]) < self.min_score:
+            return None
+        box = instances.pred_boxes.tensor[best].cpu().numpy().astype(float)
+        if crop is not None:
+            # A box touching a crop edge inside the frame is cut off.
+            h, w = shape[:2]
+            x0, y0, x1, y1 = crop
+            if ((x0 > 0 and box[0] <= x0 + 1) or (y0 > 0 and box[1] <= y0 + 1)
+                    or (x1 < w and box[2] >= x1 - 1) or (y1 < h and box[3] >= y1 - 1)):
+                return None
+        return box
+
+    def __call__(self, image):
+        """Returns the predictions for an image, like DefaultPredictor."""
+        if self.box is not None:
+            crop = self.crop_box(image.shape)
+            x0, y0, x1, y1 = crop
+            instances = self.crop_predictor(image[y0:y1, x0:x1])['instances']
+            instances = to_full_frame(instances, (x0, y0), image.shape)
+            box = self.track(instances, image.shape, crop)
+            if box is not None:
+                self.box = box
+                self.crops += 1
+                return {'instances': instances}
+
+        instances = self.predictor(image)['instances']
+        self.box = self.track(instances, image.shape)
+        self.full_frames += 1
+        return {'instances': instances}
+
+    def predict_batch(self, images):
+        """Runs the frames one by one, each crop depends on the previous frame."""
+        return [self(image) for image in images]
+
+    def skip(self):
+        """Forgets the runner when a frame is skipped."""
+        self.box = None
+
+
+def to_full_frame(instances, offset, shape):
+    """Maps instances predicted on a crop at offset (x, y) to a frame of the given shape."""
+    x0, y0 = offset
+    full = Instances(shape[:2])
+    for name, value in instances.get_fields().items():
+        if name == 'pred_boxes':
+            value = Boxes(value.tensor + value.tensor.new_tensor([x0, y0, x0, y0]))
+        elif name == 'pred_keypoints':
+            value = value.clone()
+            value[:, :, 0] += x0
+            value[:, :, 1] += y0
+        elif name == 'pred_masks':
+            masks = value.new_zeros((len(value), *shape[:2]))
+            masks[:, y0:y0 + value.shape[1], x0:x0 + value.shape[2]] = value
+            value = masks
+        full.set(name, value)
+    return full
+
+# Cell
+class KeyframePropagator:
+    """
+    Runs the detector only on keyframes and propagates the runner in between.
+    The boundary box and keypoints of the most confident person move with
+    the constant velocity measured between the last two keyframes, so the
+    frame after a first detection is detected as well.
+    A propagated frame is detected instead when the box leaves the frame or
+    when the image inside the box has drifted too far from the keyframe.
+    The predictions carry a 'propagated' flag next to the 'instances'.
+
+    Arguments:
+    predictor -- The predictor (or RoiTracker) for the keyframes.
+    interval -- Number of frames from one keyframe to the next.
+    max_drift -- Mean absolute change of the grey levels (0-1) inside the
+        box compared to the keyframe that forces a new detection.
+    grid -- Number of (x, y) points sampled in the box for the drift check.
+    """
+
+    def __init__(self, predictor, interval=4, max_drift=0.1, grid=(16, 32)):
+        self.predictor = predictor
+        self.interval = interval
+        self.max_drift = max_drift
+        self.grid = grid
+        self.frame_i = 0
+        self.keyframe_i = None
+        self.keyframes = 0
+        self.propagated = 0
+
+    def sample(self, image, box):
+        """Returns the grey levels at the grid points of the box."""
+        h, w = image.shape[:2]
+        xs = np.linspace(box[0], box[2] - 1, self.grid[0]).round().astype(int)
+        ys = np.linspace(box[1], box[3] - 1, self.grid[1]).round().astype(int)
+        xs, ys = np.clip(xs, 0, w - 1), np.clip(ys, 0, h - 1)
+        return image[ys[:, None], xs[None]].mean(axis=-1, dtype='float32')
+
+    def detect(self, image):
+        """Runs the detector and keeps the most confident person as the keyframe."""
+        instances = self.predictor(image)['instances']
+        self.keyframes += 1
+        people = instances
+        if people.has('pred_classes'):
+            people = people[people.pred_classes == 0]
+        if len(people) == 0:
+            self.keyframe_i = None
+            return {'instances': instances, 'propagated': False}
+
+        best = int(people.scores.argmax())
+        box = people.pred_boxes.tensor[best].cpu().numpy()
+        keypoints = people.pred_keypoints[best].cpu().numpy()
+        if self.keyframe_i is None:
+            self.box_velocity = self.keypoint_velocity = None
+        else:
+            dt = self.frame_i - self.keyframe_i
+            self.box_velocity = (box - self.box) / dt
+            self.keypoint_velocity = (keypoints[:, :2] - self.keypoints[:, :2]) / dt
+        self.keyframe_i = self.frame_i
+        self.box = box
+        self.keypoints = keypoints
+        self.score = float(people.scores[best])
+        self.template = self.sample(image, box)
+        return {'instances': instances, 'propagated': False}
+
+    def propagate(self, image):
+        """Returns the propagated prediction, or None if it has drifted."""
+        dt = self.frame_i - self.keyframe_i
+        box = self.box + self.box_velocity * dt
+        h, w = image.shape[:2]
+        if box[0] < 0 or box[1] < 0 or box[2] > w or box[3] > h:
+            return None
+        drift = np.abs(self.sample(image, box) - self.template).mean() / 255
+        if drift > self.max_drift:
+            return None
+
+        keypoints = self.keypoints.copy()
+        keypoints[:, :2] += self.keypoint_velocity * dt
+        instances = Instances(
+            image.shape[:2],
+            pred_boxes=Boxes(torch.as_tensor(box[None], dtype=torch.float32)),
+            scores=torch.tensor([self.score]),
+            pred_classes=torch.zeros(1, dtype=torch.int64),
+            pred_keypoints=torch.as_tensor(keypoints[None], dtype=torch.float32),
+        )
+        return {'instances': instances, 'propagated': True}
+
+    def __call__(self, image):
+        """Returns the predictions for the next frame of the video."""
+        prediction = None
+        if (self.keyframe_i is not None and self.box_velocity is not None
+                and self.frame_i - self.keyframe_i < self.interval):
+            prediction = self.propagate(image)
+        if prediction is None:
+            prediction = self.detect(image)
+        else:
+            self.propagated += 1
+        self.frame_i += 1
+        return prediction
+
+    def predict_batch(self, images):
+        """Runs the frames one by one, each frame depends on the previous keyframe."""
+        return [self(image) for image in images]
+
+    def skip(self):
+        """Counts a skipped frame, the next frame is a new first detection."""
+        self.frame_i += 1
+        self.keyframe_i = None
+        if hasattr(self.predictor, 'skip'):
+            self.predictor.skip()
+
+# Cell
+class MotionGate:
+    """
+    Skips the detector on frames without motion, e.g. before the runner
+    enters the view of the camera. Every frame is subsampled on a coarse
+    grid and compared with a background model, the running average of the
+    earlier frames. The detector runs while enough grid pixels differ from
+    the background and for a few frames after the motion has stopped.
+    A skipped frame gets no instances, like a frame where nobody is found.
+
+    Arguments:
+    predictor -- The predictor (RoiTracker or KeyframePropagator) to gate.
+    threshold -- Grey level difference (0-255) of a moving pixel.
+    min_fraction -- Fraction of moving pixels that counts as motion.
+    hold -- Number of still frames that are still detected.
+    stride -- Pixel step of the grid.
+    alpha -- Weight of a new frame in the background model.
+    """
+
+    def __init__(
+            self, predictor, threshold=25, min_fraction=0.001, hold=5,
+            stride=8, alpha=0.5):
+        self.predictor = predictor
+        self.threshold = threshold
+        self.min_fraction = min_fraction
+        self.hold = hold
+        self.stride = stride
+        self.alpha = alpha
+        self.background = None
+        self.still = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def has_motion(self, image):
+        """Compares the image with the background model and updates the model."""
+        # The green channel of the raw bgr24 buffer.
+        grid = image[::self.stride, ::self.stride, 1].astype('float32')
+        if self.background is None:
+            self.background = grid
+            return True
+        moving = np.abs(grid - self.background) > self.threshold
+        self.background += self.alpha * (grid - self.background)
+        return moving.mean() > self.min_fraction
+
+    def __call__(self, image):
+        """Returns the predictions for the next frame, without instances if it is skipped."""
+        self.frames += 1
+        self.still = 0 if self.has_motion(image) else self.still + 1
+        if self.still <= self.hold:
+            return self.predictor(image)
+
+        self.skipped += 1
+        if hasattr(self.predictor, 'skip'):
+            self.predictor.skip()
+        return {'instances': Instances(image.shape[:2])}
+
+    def predict_batch(self, images):
+        """Gates the frames one by one and detects the moving ones in one batch."""
+        if hasattr(self.predictor, 'skip'):
+            # The predictor keeps state from one frame to the next.
+            return [self(image) for image in images]
+        self.frames += len(images)
+        predictions = [None] * len(images)
+        moving = []
+        for i, image in enumerate(images):
+            self.still = 0 if self.has_motion(image) else self.still + 1
+            if self.still <= self.hold:
+                moving.append(i)
+            else:
+                self.skipped += 1
+                predictions[i] = {'instances': Instances(image.shape[:2])}
+        if len(moving) == 1:
+            predictions[moving[0]] = self.predictor(images[moving[0]])
+        elif moving:
+            detected = self.predictor.predict_batch([images[i] for i in moving])
+            for i, prediction in zip(moving, detected):
+                predictions[i] = prediction
+        return predictions
+
+# Cell
+def format_outputs(outputs):
+    """
+    Converts the instances predicted in one frame to the Detectron1 format,
+    returns the boundary boxes and the keypoints.
+    """
+    # Checks if image is "empty or not".
+    has_bbox = False
+    if outputs.has('pred_boxes'):
+        bbox_tensor = outputs.pred_boxes.tensor.numpy()
+        if len(bbox_tensor) > 0:
+            has_bbox = True
+            scores = outputs.scores.numpy()[:, None]
+            bbox_tensor = np.concatenate((bbox_tensor, scores), axis=1)
+
+    if has_bbox:
+        kps = outputs.pred_keypoints.numpy()
+        kps_xy = kps[:, :, :2]
+        kps_prob = kps[:, :, 2:3]
+        kps_logit = np.zeros_like(kps_prob) # Dummy variable.
+        kps = np.concatenate((kps_xy, kps_logit, kps_prob), axis=2)
+        kps = kps.transpose(0, 2, 1)
+    else:
+        kps = []
+        bbox_tensor = []
+
+    # Mimic Detectron1 format
+    cls_boxes = [[], bbox_tensor]
+    cls_keyps = [[], kps]
+    return cls_boxes, cls_keyps
+
+# Cell
+class PipelineStopped(Exception):
+    """Raised in a pipeline stage when another stage has failed."""
+
+
+class Stage:
+    """
+    One stage of the inference pipeline. Passes items between the stages
+    through bounded queues and keeps track of how long the stage has
+    been running and how much of that time it spent waiting on them.
+    """
+
+    def __init__(self, name, stop):
+        self.name = name
+        self.stop = stop
+        self.running = 0.
+        self.waiting = 0.
+        self.error = None
+
+    def get(self, item_queue):
+        """Returns the next item of the queue, None when the previous stage is done."""
+        t = time.time()
+        try:
+            while True:
+                try:
+                    return item_queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self.stop.is_set():
+                        raise PipelineStopped()
+        finally:
+            self.waiting += time.time() - t
+
+    def put(self, item_queue, item):
+        """Puts an item on the queue, waits while the queue is full."""
+        t = time.time()
+        try:
+            while True:
+                try:
+                    return item_queue.put(item, timeout=0.1)
+                except queue.Full:
+                    if self.stop.is_set():
+                        raise PipelineStopped()
+        finally:
+            self.waiting += time.time() - t
+
+    def run(self, target, *args):
+        """Runs target(stage, *args), a failure stops the other stages."""
+        t = time.time()
+        try:
+            target(self, *args)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            self.error = e
+            self.stop.set()
+        finally:
+            self.running = time.time() - t
+
+    def utilisation(self, wall_time):
+        """Returns the fraction of the wall time the stage spent working."""
+        return (self.running - self.waiting) / max(wall_time, 1e-9)
+
+# Cell
+def read_stage(stage, filename, batch_size, frame_queue):
+    """Decodes the video with ffmpeg and puts batches of frames on the queue."""
+    video = read_video(filename)
+    try:
+        for frames in batched(video, batch_size):
+            stage.put(frame_queue, frames)
+    finally:
+        video.close()
+    stage.put(frame_queue, None)
+
+
+def detect_stage(stage, predictor, frame_queue, prediction_queue):
+    """Runs the predictor on the batches of frames and puts the instances on the queue."""
+    frame_i = 0
     while True:
-        data = pipe.stdout.read(w*h*3)
-        if not data:
+        frames = stage.get(frame_queue)
+        if frames is None:
             break
-        yield np.frombuffer(data, dtype='uint8').reshape((h, w, 3))
+        t = time.time()
+        if len(frames) == 1:
+            predictions = [predictor(frames[0])]
+        else:
+            predictions = predictor.predict_batch(frames)
+        instances = [prediction['instances'].to('cpu') for prediction in predictions]
+        propagated = [prediction.get('propagated', False) for prediction in predictions]
+        print("Frames {}-{} processed in {:.3f}s".format(
+            frame_i, frame_i + len(frames) - 1, time.time()-t))
+        frame_i += len(frames)
+        stage.put(prediction_queue, (frames[-1].shape, instances, propagated))
+    stage.put(prediction_queue, None)
+
+
+def write_stage(stage, out_name, prediction_queue):
+    """
+    Converts the instances to the Detectron1 format and saves the .npz file,
+    with a flag for each frame that was propagated instead of detected.
+    """
+    # Initialize results:
+    boundary_boxes = []
+    segments = [] # Sets to None.
+    keypoints = []
+    propagated = []
+    shape = None
+    while True:
+        item = stage.get(prediction_queue)
+        if item is None:
+            break
+        shape, instances, flags = item
+        propagated.extend(flags)
+        for outputs in instances:
+            cls_boxes, cls_keyps = format_outputs(outputs)
+            boundary_boxes.append(cls_boxes)
+            segments.append(None)
+            keypoints.append(cls_keyps)
+
+    if shape is None:
+        raise ValueError('No frames were decoded for {}.'.format(out_name))
+
+    # Video resolution.
+    metadata = {
+        'w': shape[1],
+        'h': shape[0],
+    }
+
+    # The frames have different numbers of instances.
+    save_atomic(
+        out_name + '.npz', boxes=np.array(boundary_boxes, dtype=object),
+        segments=segments, keypoints=np.array(keypoints, dtype=object),
+        metadata=metadata,
+        propagated=np.array(propagated, dtype=bool)
+    )
 
 # Cell
-def main(args):
+def process_video(predictor, video_name, out_name, batch_size=1, queue_size=4):
     """
-    Runs inference on the video files and saves the dataset in .npz file format.
-    Predicts the boundary box and the coco keypoints.
+    Runs inference on one video as a pipeline of three stages connected by
+    bounded queues: ffmpeg decoding and the postprocessing/writing run in
+    threads while the detector runs in the calling thread.
+    Returns the stages and the wall time of the video.
     """
-    # Create a detectron2 config and a detectron2 DefaultPredictor to run inference on video.
+    stop = threading.Event()
+    frame_queue = queue.Queue(queue_size)
+    prediction_queue = queue.Queue(queue_size)
+    reader = Stage('decode', stop)
+    detector = Stage('detect', stop)
+    writer = Stage('write', stop)
+
+    t = time.time()
+    threads = [
+        threading.Thread(
+            target=reader.run, daemon=True,
+            args=(read_stage, video_name, batch_size, frame_queue)),
+        threading.Thread(
+            target=writer.run, daemon=True,
+            args=(write_stage, out_name, prediction_queue)),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        detector.run(detect_stage, predictor, frame_queue, prediction_queue)
+    finally:
+        for thread in threads:
+            thread.join()
+    wall_time = time.time() - t
+
+    stages = [reader, detector, writer]
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+    return stages, wall_time
+
+
+def utilisation_report(stages, wall_time):
+    """Returns a line with the share of the wall time each stage spent working."""
+    return 'Stage utilisation over {:.2f}s: {}'.format(wall_time, ', '.join(
+        '{} {:.0%} ({:.2f}s)'.format(
+            stage.name, stage.utilisation(wall_time), stage.running - stage.waiting)
+        for stage in stages
+    ))
+
+# Cell
+def file_hash(filename, chunk_size=1 << 20):
+    """Returns the sha256 hex digest of the content of a file."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def save_atomic(filename, **arrays):
+    """
+    Saves the arrays as a compressed .npz file. The file is written under
+    a temporary name and then renamed, so it is either complete or missing.
+    """
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_name, filename)
+
+
+def load_manifest(output_dir):
+    """Returns the manifest of the videos processed into output_dir."""
+    path = os.path.join(output_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    """Atomically writes the manifest of output_dir."""
+    path = os.path.join(output_dir, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_processed(manifest, output_dir, video_name, video_hash, settings):
+    """
+    Returns True if the output of the video exists and was made from the same
+    video content with the same settings (model config and tracking).
+    """
+    entry = manifest.get(os.path.basename(video_name))
+    return (
+        entry is not None
+        and entry['hash'] == video_hash
+        and entry.get('settings') == settings
+        and os.path.exists(os.path.join(output_dir, entry['output']))
+    )
+
+# Cell
+def build_predictor(cfg_file, threads=None):
+    """Creates a BatchPredictor for a detectron2 model zoo config."""
+    # Create a detectron2 config and a detectron2 predictor to run inference on video.
     cfg = get_cfg()
-    cfg.merge_from_file(model_zoo.get_config_file(args.cfg))
+    cfg.merge_from_file(model_zoo.get_config_file(cfg_file))
     cfg.MODEL.ROI_HEADS.SCORE_TRESH_TEST = 0.7 # Set threshold for this model.
-    cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(args.cfg)
-    predictor = DefaultPredictor(cfg)
+    cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(cfg_file)
+    if threads is not None:
+        torch.set_num_threads(threads)
+    return BatchPredictor(cfg)
+
 
+# The predictor of a worker process.
+_predictor = None
+
+def init_worker(cfg_file, threads=None):
+    """Creates the predictor of the current process."""
+    global _predictor
+    _predictor = build_predictor(cfg_file, threads)
+
+
+def process_worker(
+        video_name, out_name, batch_size=1, queue_size=4, track_size=None,
+        keyframe_interval=1, max_drift=0.1, motion_threshold=None,
+        motion_fraction=0.001):
+    """
+    Runs inference on one video with the predictor of the current process,
+    on crops around the runner if a track size is given, only on
+    keyframes if the keyframe interval is above 1 and only on frames
+    with motion if a motion threshold is given.
+    """
+    print("Processing {}".format(video_name))
+    predictor = _predictor
+    if track_size is not None:
+        predictor = tracker = RoiTracker(predictor, crop_size=track_size)
+    if keyframe_interval > 1:
+        predictor = propagator = KeyframePropagator(
+            predictor, keyframe_interval, max_drift)
+    if motion_threshold is not None:
+        predictor = gate = MotionGate(
+            predictor, motion_threshold, motion_fraction)
+    stages, wall_time = process_video(
+        predictor, video_name, out_name, batch_size, queue_size)
+    report = utilisation_report(stages, wall_time)
+    if track_size is not None:
+        report += ', {} of {} frames detected on crops'.format(
+            tracker.crops, tracker.crops + tracker.full_frames)
+    if keyframe_interval > 1:
+        report += ', {} of {} frames propagated'.format(
+            propagator.propagated, propagator.propagated + propagator.keyframes)
+    if motion_threshold is not None:
+        report += ', {} of {} frames skipped ({:.0%})'.format(
+            gate.skipped, gate.frames, gate.skipped / max(gate.frames, 1))
+    return report
+
+# Cell
+def main(args):
+    """
+    Runs inference on the video files and saves the dataset in .npz file format.
+    Predicts the boundary box and the coco keypoints.
+    With a batch size above 1 the frames are passed through the model in batches.
+
+    The videos are processed by a pool of workers, each with its own predictor.
+    A manifest in the output directory records the content hash of every
+    processed video, so videos with an up to date output are skipped and
+    an interrupted run continues where it stopped.
+    With --track the runner is detected on crops around its previous box.
+    With --keyframe-interval K the detector runs every K:th frame and
+    the frames in between are propagated, they are flagged in the output.
+    With --motion-gate the frames without motion are not detected.
+    """
     # Load the video folder in which we should predict.
     if os.path.isdir(args.im_or_folder):
-        im_list = glob.iglob(args.im_or_folder + '/*.' + args.image_ext)
+        im_list = sorted(glob.iglob(args.im_or_folder + '/*.' + args.image_ext))
     else:
         im_list = [args.im_or_folder]
 
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = load_manifest(args.output_dir)
+    track_size = args.track_size if args.track else None
+    keyframe_interval = max(args.keyframe_interval, 1)
+    motion_threshold = args.motion_threshold if args.motion_gate else None
+    settings = {
+        'cfg': args.cfg,
+        'track_size': track_size,
+        'keyframe_interval': keyframe_interval,
+        'max_drift': args.max_drift if keyframe_interval > 1 else None,
+        'motion_threshold': motion_threshold,
+        'motion_fraction': args.motion_fraction if args.motion_gate else None,
+    }
+    jobs = {}
     for video_name in im_list:
+        video_hash = file_hash(video_name)
+        if is_processed(manifest, args.output_dir, video_name, video_hash, settings):
+            print("Skipping {}, already processed".format(video_name))
+            continue
         out_name = os.path.join(args.output_dir, os.path.basename(video_name))
-        print("Processing {}".format(video_name))
-
-        # Initialize results:
-        boundary_boxes = []
-        segments = [] # Sets to None.
-        keypoints = []
-        for frame_i, im in enumerate(read_video(video_name)):
-            t = time.time()
-            outputs = predictor(im)['instances'].to('cpu')
-            print("Frame {} processed in {:.3f}s".format(frame_i, time.time()-t))
-
-            # Checks if image is "empty or not".
-            has_bbox = False
-            if outputs.has('pred_boxes'):
-                bbox_tensor = outputs.pred_boxes.tensor.numpy()
-                if len(bbox_tensor) > 0:
-                    has_bbox = True
-                    scores = outputs.scores.numpy()[:, None]
-                    bbox_tensor = np.concatenate((bbox_tensor, scores), axis=1)
-
-            if has_bbox:
-                kps = outputs.pred_keypoints.numpy()
-                kps_xy = kps[:, :, :2]
-                kps_prob = kps[:, :, 2:3]
-                kps_logit = np.zeros_like(kps_prob) # Dummy variable.
-                kps = np.concatenate((kps_xy, kps_logit, kps_prob), axis=2)
-                kps = kps.transpose(0, 2, 1)
-            else:
-                kps = []
-                bbox_tensor = []
+        jobs[video_name] = (out_name, video_hash)
 
-            # Mimic Detectron1 format
-            cls_boxes = [[], bbox_tensor]
-            cls_keyps = [[], kps]
+    # Share the cores between the workers unless told otherwise.
+    threads = args.threads
+    if threads is None and args.workers > 1:
+        threads = max(1, os.cpu_count() // args.workers)
 
-            boundary_boxes.append(cls_boxes)
-            segments.append(None)
-            keypoints.append(cls_keyps)
-
-        # Video resolution.
-        metadata = {
-            'w': im.shape[1],
-            'h': im.shape[0],
+    failed = []
+    with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(args.cfg, threads)) as executor:
+        futures = {
+            executor.submit(
+                process_worker, video_name, out_name,
+                args.batch_size, args.queue_size, track_size,
+                keyframe_interval, args.max_drift,
+                motion_threshold, args.motion_fraction): video_name
+            for video_name, (out_name, _) in jobs.items()
         }
+        for future in as_completed(futures):
+            video_name = futures[future]
+            try:
+                print('Finished {}. {}'.format(video_name, future.result()))
+            except Exception as e:
+                print("Failed to process {}: {}".format(video_name, e))
+                failed.append(video_name)
+                continue
+            out_name, video_hash = jobs[video_name]
+            manifest[os.path.basename(video_name)] = {
+                'hash': video_hash,
+                'settings': settings,
+                'output': os.path.basename(out_name) + '.npz',
+            }
+            save_manifest(args.output_dir, manifest)
 
-        np.savez_compressed(
-            out_name, boxes=boundary_boxes, segments=segments,
-            keypoints=keypoints, metadata=metadata
-        )
+    if failed:
+        raise RuntimeError('Failed to process: ' + ', '.join(failed))
 
 # Cell
 try: from nbdev.imports import IN_NOTEBOOK
@@ -1,60 +1,93 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/13_prepare_data_2d_custom.ipynb (unless otherwise specified).
 
-__all__ = ['output_prefix_2d', 'decode', 'coco_metadata', 'h36m_metadata', 'suggest_metadata']
+__all__ = ['output_prefix_2d', 'select_best_instances', 'interpolate_missing', 'decode', 'coco_metadata',
+           'h36m_metadata', 'suggest_metadata', 'decode_to_store', 'main']
 
 # Cell
 import argparse
+import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
+from itertools import repeat
 
 import numpy as np
 
 # Cell
 output_prefix_2d = 'data_2d_custom_'
 
+# Cell
+def select_best_instances(boxes, keypoints):
+    """
+    Picks the instance with the highest box score in each frame, for
+    the person class of Detectron boxes and keypoints.
+
+    Returns the boxes (frames, 4) and keypoints (frames, 17, 4) of the
+    best instances, NaN for frames without detections.
+    """
+    counts = np.array([
+        len(boxes_i[1]) if len(keypoints_i[1]) > 0 else 0
+        for boxes_i, keypoints_i in zip(boxes, keypoints)
+    ], dtype=int)
+    detected = counts > 0
+    best_boxes = np.full((len(boxes), 4), np.nan, dtype=np.float32)
+    best_keypoints = np.full((len(boxes), 17, 4), np.nan, dtype=np.float32)
+    if not detected.any():
+        return best_boxes, best_keypoints
+
+    # All instances of all frames, sorted by frame and then by score.
+    all_boxes = np.concatenate([boxes[i][1] for i in np.flatnonzero(detected)])
+    all_keypoints = np.concatenate([keypoints[i][1] for i in np.flatnonzero(detected)])
+    frames = np.repeat(np.arange(len(boxes)), counts)
+    order = np.lexsort((-all_boxes[:, 4], frames))
+    first = (np.cumsum(counts) - counts)[detected]
+    best = order[first]
+
+    best_boxes[detected] = all_boxes[best, :4]
+    best_keypoints[detected] = all_keypoints[best].transpose(0, 2, 1)
+    return best_boxes, best_keypoints
+
+def interpolate_missing(data, mask):
+    """
+    Fills the frames of data (frames, *) that are not in mask by linear
+    interpolation between the closest frames in mask, like np.interp for
+    all the other dimensions at once.
+    """
+    indices = np.arange(len(data))
+    valid = indices[mask]
+    if len(valid) == 0:
+        raise ValueError('No frames to interpolate from.')
+    right = np.searchsorted(valid, indices).clip(0, len(valid) - 1)
+    left = (right - 1).clip(0, len(valid) - 1)
+    x0, x1 = valid[left], valid[right]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(x1 > x0, (indices - x0) / (x1 - x0), 0)
+    # Frames after the last valid frame keep its value, like np.interp.
+    weight = weight.clip(0, 1)
+    weight = weight.reshape(-1, *[1] * (data.ndim - 1))
+
+    data_valid = data[mask]
+    filled = data_valid[left]*(1 - weight) + data_valid[right]*weight
+    return filled.astype(data.dtype, copy=False)
+
 # Cell
 def decode(filename):
-    """Decodes the 2D data and returns a list with a dictionary and the following metadata."""
+    """
+    Decodes the 2D data and returns a list with a dictionary and the
+    following metadata. The confidence of the keypoints is 0 for the
+    interpolated frames.
+    """
     print('Processing {}'.format(filename))
     data = np.load(filename, allow_pickle=True)
-    boundary_box = data['boxes']
-    key_points = data['keypoints']
     metadata = data['metadata'].item()
-
-    results_boundary_box = []
-    results_key_points = []
-    for i in range(len(boundary_box)):
-        if len(boundary_box[i][1]) == 0 or len(key_points[i][1]) == 0:
-            # No bbox/keypoints detected for this frame -> will be interpolated.
-            # 4 bounding box coordinates.
-            results_boundary_box.append(np.full(4, np.nan, dtype=np.float32))
-            # 17 COCO keypoints
-            results_key_points.append(np.full((17, 4), np.nan, dtype=np.float32))
-            continue
-        best_match = np.argmax(boundary_box[i][1][:, 4])
-        best_boundary_box = boundary_box[i][1][best_match, :4]
-        best_key_point = key_points[i][1][best_match].T.copy()
-        results_boundary_box.append(best_boundary_box)
-        results_key_points.append(best_key_point)
-
-    boundary_box = np.array(results_boundary_box, dtype=np.float32)
-    key_points = np.array(results_key_points, dtype=np.float32)
-    key_points = key_points[:, :, :2] # Extract (x,y)
+    boundary_box, key_points = select_best_instances(data['boxes'], data['keypoints'])
 
     # Fix missing bboxes/keypoints by linear interpolation
     mask = ~np.isnan(boundary_box[:, 0])
-    indices = np.arange(len(boundary_box))
-    for i in range(4):
-        boundary_box[:, i] = np.interp(
-            indices, indices[mask], boundary_box[mask, i]
-        )
-
-    for i in range(17):
-        for j in range(2):
-            key_points[:, i, j] = np.interp(
-                indices, indices[mask], key_points[mask, i, j]
-            )
+    confidence = np.where(mask[:, None], key_points[:, :, 3], 0).astype(np.float16)
+    boundary_box = interpolate_missing(boundary_box, mask)
+    key_points = interpolate_missing(key_points[:, :, :2], mask) # Extract (x,y)
 
     print('{} total frames processed'.format(len(boundary_box)))
     print('{} frames were interpolated'.format(np.sum(~mask)))
@@ -65,6 +98,7 @@ def decode(filename):
         'end_frame': len(key_points), # Exclusive
         'bounding_boxes': boundary_box,
         'keypoints': key_points,
+        'confidence': confidence,
     }], metadata
 
 # Cell
@@ -97,6 +131,58 @@ def suggest_metadata(name):
         names.append(metadata['layout_name'])
     raise KeyError('Cannot infer keypoint layout from name "{}". Tried {}.'.format(name, names))
 
+# Cell
+def decode_to_store(filename, output_dir, confidence=False):
+    """
+    Decodes a file and saves its keypoints, and optionally their
+    confidence, in the store directory. Returns the video name and metadata.
+    """
+    canonical_name = os.path.splitext(os.path.basename(filename))[0]
+    data, video_metadata = decode(filename)
+    np.save(
+        os.path.join(output_dir, canonical_name + '.npy'),
+        data[0]['keypoints'].astype('float32')
+    )
+    if confidence:
+        np.save(
+            os.path.join(output_dir, canonical_name + '_confidence.npy'),
+            data[0]['confidence']
+        )
+    return canonical_name, video_metadata
+
+def main(args):
+    """
+    Decodes all detections in the input directory in parallel into the
+    dataset store data_2d_custom_<output>, which is loaded in place of
+    data_2d_custom_<output>.npz. Each video is saved when it is decoded,
+    the index with the metadata last.
+    """
+    metadata = suggest_metadata('coco')
+    metadata['video_metadata'] = {}
+
+    output_dir = output_prefix_2d + args.output
+    os.makedirs(output_dir, exist_ok=True)
+    file_list = sorted(glob(args.input + '/*.npz'))
+    with ProcessPoolExecutor(args.workers) as executor:
+        results = list(executor.map(
+            decode_to_store, file_list, repeat(output_dir), repeat(args.confidence)))
+
+    positions_2d = {}
+    confidence_2d = {}
+    for canonical_name, video_metadata in results:
+        positions_2d[canonical_name] = {
+            'dict': {'custom': {'list': [{'npy': canonical_name + '.npy'}]}}}
+        confidence_2d[canonical_name] = {
+            'dict': {'custom': {'list': [{'npy': canonical_name + '_confidence.npy'}]}}}
+        metadata['video_metadata'][canonical_name] = video_metadata
+
+    # The index of the store, in the format of runningpose.core.utils.save_array_tree
+    index = {'positions_2d': {'dict': positions_2d}, 'metadata': {'value': metadata}}
+    if args.confidence:
+        index['confidence_2d'] = {'dict': confidence_2d}
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+        json.dump({'dict': index}, f)
+
 # Cell
 try: from nbdev.imports import IN_NOTEBOOK
 except: IN_NOTEBOOK=False
@@ -115,6 +201,14 @@ if __name__ == '__main__' and not IN_NOTEBOOK:
         '-o', '--output', type=str, default='',
         metavar='PATH', help='output suffix for 2D detections'
     )
+    parser.add_argument(
+        '-w', '--workers', type=int,
+        help='number of processes decoding detections (default: number of cpus)'
+    )
+    parser.add_argument(
+        '--confidence', action='store_true',
+        help='also save the keypoint confidence, as float16'
+    )
     args = parser.parse_args()
 
     if not args.input:
@@ -126,21 +220,5 @@ if __name__ == '__main__' and not IN_NOTEBOOK:
         exit(0)
 
     print('Parsing 2D detections from', args.input)
-
-    metadata = suggest_metadata('coco')
-    metadata['video_metadata'] = {}
-
-    output = {}
-    file_list = glob(args.input + '/*.npz')
-    for f in file_list:
-        canonical_name = os.path.splitext(os.path.basename(f))[0]
-        data, video_metadata = decode(f)
-        output[canonical_name] = {}
-        output[canonical_name]['custom'] = [data[0]['keypoints'].astype('float32')]
-        metadata['video_metadata'][canonical_name] = video_metadata
-
-    print('Saving...')
-    np.savez_compressed(
-        output_prefix_2d + args.output, positions_2d=output, metadata=metadata
-    )
+    main(args)
     print('Done.')
\ No newline at end of file
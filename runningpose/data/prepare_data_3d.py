@@ -1,11 +1,15 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/21_prepare_data_3d.ipynb (unless otherwise specified).
 
-__all__ = ['parse_args', 'world_to_camera_miqus', 'runningpose_cameras_extrinsic_params', 'convert_to_camera', 'main']
+__all__ = ['parse_args', 'stack_extrinsic_params', 'runningpose_cameras_extrinsic_params', 'load_world_keypoints',
+           'convert_to_cameras', 'convert_to_camera', 'convert_file', 'write_index', 'main']
 
 # Cell
 import argparse
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
+from itertools import repeat
 
 import numpy as np
 import pandas as pd
@@ -24,33 +28,19 @@ def parse_args():
     )
     parser.add_argument(
         '-c', '--camera',
-        help='which misqus camera (1, 2, 3) to use in runningpose dataset',
+        help='which misqus camera (1, 2, 3) to use in runningpose dataset, all if not given',
         type=int,
         choices=range(1, 4)
     )
+    parser.add_argument(
+        '-w', '--workers', type=int,
+        help='number of processes converting files (default: number of cpus)'
+    )
 
     return parser.parse_args()
 
 # Cell
 # Need to define this here aswell since relative imports are a thing
-def world_to_camera_miqus(P, R, T):
-  """
-  Convert points from world to camera coordinates
-  Args
-    P: Nx3 3d points in world coordinates
-    R: 3x3 Camera rotation matrix
-    T: 3x1 Camera translation parameters
-  Returns
-    X_cam: Nx3 3d points in camera coordinates
-  """
-
-  assert len(P.shape) == 2
-  assert P.shape[1] == 3
-
-  X_cam = R.dot( P.T - T ) # rotate and translate
-
-  return X_cam.T
-
 runningpose_cameras_extrinsic_params = [
     {   # Miqus video camera 1
         'rotation': np.array([
@@ -78,42 +68,95 @@ runningpose_cameras_extrinsic_params = [
     },
 ]
 
+def stack_extrinsic_params(cameras):
+    '''Returns the rotations (C, 3, 3) and translations (C, 3) of the cameras.'''
+    R = np.stack([np.asarray(cam['rotation'], dtype='float64') for cam in cameras])
+    T = np.stack([np.asarray(cam['translation'], dtype='float64') for cam in cameras])
+    return R, T
+
 # Cell
+def load_world_keypoints(filename):
+    '''
+    Loads the 3D world coordinates of a format_qtmdata output, either a csv
+    file with x, y and z rows for each frame or a npy file.
+
+    Returns: A numpy array with shape: (num_frames, num_keypoints, dimension)
+    '''
+    if filename.endswith('.npy'):
+        return np.load(filename)
+    # The first column is the index of the rows, not a keypoint
+    data_3D_world = pd.read_csv(filename, index_col=0).values
+    return data_3D_world.reshape(-1, 3, data_3D_world.shape[1]).transpose(0, 2, 1)
+
+def convert_to_cameras(keypoints_world, cameras):
+    '''
+    Converts 3D world coordinates with shape (num_frames, num_keypoints, 3)
+    to the 3D camera coordinates of all the given cameras at once.
+
+    Returns: A numpy array with shape: (num_cameras, num_frames, num_keypoints, dimension)
+    '''
+    R, T = stack_extrinsic_params(cameras)
+    # Rotate and translate all frames and cameras with one matmul
+    return (keypoints_world[None] - T[:, None, None]) @ R.swapaxes(-1, -2)[:, None]
+
 def convert_to_camera(filename, cam):
     '''
-    Converts the csv file with 3D world coordinates to 3D camera coordinates.
+    Converts the csv or npy file with 3D world coordinates to 3D camera
+    coordinates of miqus camera cam (1, 2, 3).
 
     Returns: A numpy array with shape: (num_frames, num_keypoints, dimension)
     '''
-    # TODO: check the 3D data so it doesnt have a unnamed column
     print('Processing {}'.format(filename))
-    # Load the 3D world coordinates data
-    data_3D_world = pd.read_csv(filename)
-    # Get camera parameters.
-    R = runningpose_cameras_extrinsic_params[cam-1]['rotation']
-    T = np.array([runningpose_cameras_extrinsic_params[cam-1]['translation']]).T
-    # Extract a keypoint column and calculate it to 3D camera coordinates
-    data_3D_camera = []
-    for column in data_3D_world:
-        col_data = data_3D_world[column].values
-        x_data = col_data[0::3]
-        y_data = col_data[1::3]
-        z_data = col_data[2::3]
-        keypdata_world = np.array([x_data, y_data, z_data]).T
-        data_3D_camera.append(world_to_camera_miqus(keypdata_world, R, T))
-
-    # Convert to a array and transpose so that it matches our 2D data input
-    data_3D_camera = np.array(data_3D_camera).transpose(1, 0, 2)
-
-    return data_3D_camera
+    keypoints_world = load_world_keypoints(filename)
+    camera = runningpose_cameras_extrinsic_params[cam-1]
+    return convert_to_cameras(keypoints_world, [camera])[0]
 
 # Cell
+def convert_file(filename, cams, output_dir, suffixes):
+    '''
+    Converts a file to the 3D camera coordinates of the miqus cameras cams
+    and saves them right away, as <name><suffix>.npy in the output
+    directory with the suffix of each camera.
+
+    Returns: The name of the sequence.
+    '''
+    print('Processing {}'.format(filename))
+    canonical_name = os.path.splitext(os.path.basename(filename))[0]
+    keypoints_world = load_world_keypoints(filename)
+    cameras = [runningpose_cameras_extrinsic_params[cam-1] for cam in cams]
+    data_3D_cameras = convert_to_cameras(keypoints_world, cameras)
+    for data_3D_camera, suffix in zip(data_3D_cameras, suffixes):
+        np.save(
+            os.path.join(output_dir, canonical_name + suffix + '.npy'),
+            data_3D_camera.astype('float32')
+        )
+    return canonical_name
+
+def write_index(output_dir, names, suffixes):
+    '''
+    Writes the index of the positions_3d of a dataset store, in the format
+    of runningpose.core.utils.save_array_tree. A sequence is one array for
+    a single camera, otherwise a list with an array per camera.
+    '''
+    def entry(name):
+        if len(suffixes) == 1:
+            return {'npy': name + suffixes[0] + '.npy'}
+        return {'list': [{'npy': name + suffix + '.npy'} for suffix in suffixes]}
+
+    index = {'dict': {'positions_3d': {'dict': {name: entry(name) for name in names}}}}
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+        json.dump(index, f)
+
 def main(args):
     '''
     Creates a 3D camera coordinates dataset for data collected with
-    miqus cameras.
+    miqus cameras. The files are converted in parallel and each one is
+    saved when it is done, in the dataset store data_3d_<output>. It is
+    loaded in place of data_3d_<output>.npz, e.g. with load_dataset.
 
-    Returns: Dictionary with all the 3D data for each run.
+    With a camera, positions_3d[<name>] is the sequence in that camera,
+    saved as <name>.npy. Without, it is a list with the sequence in
+    cameras 1, 2 and 3, saved as <name>_camera<N>.npy.
     '''
     if not args.input:
         print('Please specify the input directory')
@@ -123,23 +166,25 @@ def main(args):
         print('Please specify an output suffix (e.g. detectron_pt_coco)')
         exit(0)
 
-    if not args.camera:
-        print()
-
     print('Parsing 3D data from', args.input)
 
-    output = {}
     output_prefix_3d = 'data_3d_'
-    file_list = glob(args.input + '/*.csv')
-    for f in file_list:
-        canonical_name = os.path.splitext(os.path.basename(f))[0]
-        data_3D_camera = convert_to_camera(f, args.camera)
-        output[canonical_name] = data_3D_camera
-
-    print('Saving...')
-    np.savez_compressed(
-        output_prefix_3d + args.output, positions_3d=output
-    )
+    output_dir = output_prefix_3d + args.output
+    if args.camera:
+        cams = [args.camera]
+        suffixes = ['']
+    else:
+        cams = [1, 2, 3]
+        suffixes = ['_camera{}'.format(cam) for cam in cams]
+    os.makedirs(output_dir, exist_ok=True)
+
+    file_list = sorted(glob(args.input + '/*.csv') + glob(args.input + '/*.npy'))
+    with ProcessPoolExecutor(args.workers) as executor:
+        names = list(executor.map(
+            convert_file, file_list, repeat(cams), repeat(output_dir), repeat(suffixes)))
+
+    # The index makes the store complete
+    write_index(output_dir, names, suffixes)
 
 # Cell
 try: from nbdev.imports import IN_NOTEBOOK
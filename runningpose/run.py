@@ -7,13 +7,15 @@ import torch.optim as optim
 import os
 import sys
 import errno
+from concurrent.futures import ThreadPoolExecutor
 
 from core.arguments import parse_args
 from core.camera import *
 from core.model import *
 from core.loss import *
-from core.generators import ChunkedGenerator, UnchunkedGenerator
-from core.utils import deterministic_random
+from core.generators import ChunkedGenerator, UnchunkedGenerator, PrefetchGenerator
+from core.mocap_dataset import dataset_source, load_dataset
+from core.utils import deterministic_random, hash_inputs, load_array_tree, save_array_tree
 from time import time
 
 args = parse_args()
@@ -37,53 +39,103 @@ elif args.dataset.startswith('custom'):
 else:
     raise KeyError('Invalid dataset')
 
-print('Preparing data...')
-for subject in dataset.subjects():
-    for action in dataset[subject].keys():
-        anim = dataset[subject][action]
+def prepare_data():
+    """
+    Converts the 3D poses to camera space and prepares the 2D detections.
+    Returns the metadata and the prepared keypoints.
+    """
+    for subject in dataset.subjects():
+        for action in dataset[subject].keys():
+            anim = dataset[subject][action]
         
-        if 'positions' in anim:
-            positions_3d = []
-            for cam in anim['cameras']:
-                pos_3d = world_to_camera(anim['positions'], R=cam['orientation'], t=cam['translation'])
-                pos_3d[:, 1:] -= pos_3d[:, :1] # Remove global offset, but keep trajectory in first position
-                positions_3d.append(pos_3d)
-            anim['positions_3d'] = positions_3d
-
-print('Loading 2D detections...')
-keypoints = np.load('data/data_2d_' + args.dataset + '_' + args.keypoints + '.npz', allow_pickle=True)
-keypoints_metadata = keypoints['metadata'].item()
-keypoints_symmetry = keypoints_metadata['keypoints_symmetry']
-kps_left, kps_right = list(keypoints_symmetry[0]), list(keypoints_symmetry[1])
-joints_left, joints_right = list(dataset.skeleton().joints_left()), list(dataset.skeleton().joints_right())
-keypoints = keypoints['positions_2d'].item()
-
-for subject in dataset.subjects():
-    assert subject in keypoints, 'Subject {} is missing from the 2D detections dataset'.format(subject)
-    for action in dataset[subject].keys():
-        assert action in keypoints[subject], 'Action {} of subject {} is missing from the 2D detections dataset'.format(action, subject)
-        if 'positions_3d' not in dataset[subject][action]:
-            continue
+            if 'positions' in anim:
+                positions_3d = []
+                for cam in anim['cameras']:
+                    pos_3d = world_to_camera(anim['positions'], R=cam['orientation'], t=cam['translation'])
+                    pos_3d[:, 1:] -= pos_3d[:, :1] # Remove global offset, but keep trajectory in first position
+                    positions_3d.append(pos_3d)
+                anim['positions_3d'] = positions_3d
+
+    print('Loading 2D detections...')
+    keypoints_metadata = load_dataset(keypoints_path, 'metadata')
+    keypoints = load_dataset(keypoints_path, 'positions_2d')
+
+    for subject in dataset.subjects():
+        assert subject in keypoints, 'Subject {} is missing from the 2D detections dataset'.format(subject)
+        for action in dataset[subject].keys():
+            assert action in keypoints[subject], 'Action {} of subject {} is missing from the 2D detections dataset'.format(action, subject)
+            if 'positions_3d' not in dataset[subject][action]:
+                continue
             
-        for cam_idx in range(len(keypoints[subject][action])):
+            for cam_idx in range(len(keypoints[subject][action])):
             
-            # We check for >= instead of == because some videos in H3.6M contain extra frames
-            mocap_length = dataset[subject][action]['positions_3d'][cam_idx].shape[0]
-            assert keypoints[subject][action][cam_idx].shape[0] >= mocap_length
+                # We check for >= instead of == because some videos in H3.6M contain extra frames
+                mocap_length = dataset[subject][action]['positions_3d'][cam_idx].shape[0]
+                assert keypoints[subject][action][cam_idx].shape[0] >= mocap_length
             
-            if keypoints[subject][action][cam_idx].shape[0] > mocap_length:
-                # Shorten sequence
-                keypoints[subject][action][cam_idx] = keypoints[subject][action][cam_idx][:mocap_length]
+                if keypoints[subject][action][cam_idx].shape[0] > mocap_length:
+                    # Shorten sequence
+                    keypoints[subject][action][cam_idx] = keypoints[subject][action][cam_idx][:mocap_length]
 
-        assert len(keypoints[subject][action]) == len(dataset[subject][action]['positions_3d'])
+            assert len(keypoints[subject][action]) == len(dataset[subject][action]['positions_3d'])
         
-for subject in keypoints.keys():
-    for action in keypoints[subject]:
-        for cam_idx, kps in enumerate(keypoints[subject][action]):
-            # Normalize camera frame
-            cam = dataset.cameras()[subject][cam_idx]
-            kps[..., :2] = normalize_screen_coordinates(kps[..., :2], w=cam['res_w'], h=cam['res_h'])
-            keypoints[subject][action][cam_idx] = kps
+    for subject in keypoints.keys():
+        for action in keypoints[subject]:
+            for cam_idx, kps in enumerate(keypoints[subject][action]):
+                # Normalize camera frame
+                cam = dataset.cameras()[subject][cam_idx]
+                # Sequences of a dataset store are read-only memory maps.
+                kps = np.require(kps, dtype=dataset.dtype(), requirements='W')
+                kps[..., :2] = normalize_screen_coordinates(kps[..., :2], w=cam['res_w'], h=cam['res_h'])
+                if args.undistort and 'radial_distortion' in cam:
+                    # The camera is normalized as well, so is the image.
+                    aspect = cam['res_h'] / cam['res_w']
+                    grid = UndistortionGrid(cam, (-1, -aspect, 1, aspect), cache_dir=args.cache_dir or None)
+                    kps[..., :2] = grid(kps[..., :2])
+                keypoints[subject][action][cam_idx] = kps
+
+    return keypoints_metadata, keypoints
+
+keypoints_path = 'data/data_2d_' + args.dataset + '_' + args.keypoints + '.npz'
+prepared_path = None
+if args.cache_dir:
+    # The prepared arrays only depend on the input files, the camera
+    # calibrations and these arguments.
+    inputs = [dataset_source(path) for path in [keypoints_path, dataset_path]]
+    inputs = [path for path in inputs if os.path.exists(path)]
+    key = hash_inputs(inputs, dataset=args.dataset, keypoints=args.keypoints, cameras=dataset.cameras(),
+                      undistort=args.undistort, dtype=str(dataset.dtype()), version=2)
+    prepared_path = os.path.join(args.cache_dir, 'prepared_' + key)
+
+if prepared_path is not None and os.path.exists(prepared_path):
+    print('Loading prepared data from', prepared_path)
+    prepared = load_array_tree(prepared_path)
+    keypoints_metadata, keypoints = prepared['keypoints_metadata'], prepared['keypoints']
+    for subject, actions in prepared['positions_3d'].items():
+        for action, positions_3d in actions.items():
+            dataset[subject][action]['positions_3d'] = positions_3d
+else:
+    print('Preparing data...')
+    keypoints_metadata, keypoints = prepare_data()
+    if prepared_path is not None:
+        try:
+            save_array_tree(prepared_path, {
+                'keypoints_metadata': keypoints_metadata,
+                'keypoints': keypoints,
+                'positions_3d': {
+                    subject: {
+                        action: anim['positions_3d'] 
+                        for action, anim in dataset[subject].items() if 'positions_3d' in anim
+                    }
+                    for subject in dataset.subjects()
+                },
+            })
+        except FileExistsError:
+            pass # Another process prepared the same data first.
+
+keypoints_symmetry = keypoints_metadata['keypoints_symmetry']
+kps_left, kps_right = list(keypoints_symmetry[0]), list(keypoints_symmetry[1])
+joints_left, joints_right = list(dataset.skeleton().joints_left()), list(dataset.skeleton().joints_right())
 
 subjects_train = args.subjects_train.split(',')
 subjects_semi = [] if not args.subjects_unlabeled else args.subjects_unlabeled.split(',')
@@ -148,6 +200,9 @@ def fetch(subjects, action_filter=None, subset=1, parse_3d_poses=True):
             if out_poses_3d is not None:
                 out_poses_3d[i] = out_poses_3d[i][::stride]
     
+    # Everything is kept in the dataset dtype, so the generators never have to convert
+    for out in [out_camera_params, out_poses_3d, out_poses_2d]:
+        assert out is None or all(x.dtype == dataset.dtype() for x in out), 'Data upcast from {}'.format(dataset.dtype())
 
     return out_camera_params, out_poses_3d, out_poses_2d
 
@@ -159,10 +214,18 @@ cameras_valid, poses_valid, poses_valid_2d = fetch(subjects_test, action_filter)
 
 filter_widths = [int(x) for x in args.architecture.split(',')]
 
-model_pos_train = TemporalModel(poses_valid_2d[0].shape[-2], poses_valid_2d[0].shape[-1], 
-                                dataset.skeleton().num_joints(),
-                                filter_widths=filter_widths, causal=args.causal, dropout=args.dropout, channels=args.channels,
-                                dense=args.dense)
+if not args.disable_optimizations and not args.dense and args.stride == 1:
+    # Use optimized model for single-frame predictions
+    model_pos_train = TemporalModelOptimized1f(poses_valid_2d[0].shape[-2], poses_valid_2d[0].shape[-1], 
+                                               dataset.skeleton().num_joints(),
+                                               filter_widths=filter_widths, causal=args.causal, dropout=args.dropout,
+                                               channels=args.channels)
+else:
+    # When incompatible settings are detected (stride > 1, dense filters, or disabled optimization) fall back to normal model
+    model_pos_train = TemporalModel(poses_valid_2d[0].shape[-2], poses_valid_2d[0].shape[-1], 
+                                    dataset.skeleton().num_joints(),
+                                    filter_widths=filter_widths, causal=args.causal, dropout=args.dropout, channels=args.channels,
+                                    dense=args.dense)
     
 model_pos = TemporalModel(poses_valid_2d[0].shape[-2], poses_valid_2d[0].shape[-1], 
                           dataset.skeleton().num_joints(),
@@ -207,6 +270,16 @@ if args.resume or args.evaluate:
         model_traj = None
         
     
+eval_executor = None
+if args.eval_workers > 0:
+    eval_executor = ThreadPoolExecutor(args.eval_workers)
+
+def predict(model, inputs_2d):
+    # Long sequences are predicted a window at a time to bound the activation memory
+    if args.eval_window > 0:
+        return infer_windowed(model, inputs_2d, args.eval_window, eval_executor)
+    return model(inputs_2d)
+
 test_generator = UnchunkedGenerator(cameras_valid, poses_valid, poses_valid_2d,
                                     pad=pad, causal_shift=causal_shift, augment=False,
                                     kps_left=kps_left, kps_right=kps_right, joints_left=joints_left, joints_right=joints_right)
@@ -219,8 +292,14 @@ if not args.evaluate:
     if semi_supervised:
         cameras_semi, _, poses_semi_2d = fetch(subjects_semi, action_filter, parse_3d_poses=False)
         
-        # When incompatible settings are detected (stride > 1, dense filters, or disabled optimization) fall back to normal model
-        model_traj_train = TemporalModel(poses_valid_2d[0].shape[-2], poses_valid_2d[0].shape[-1], 1,
+        if not args.disable_optimizations and not args.dense and args.stride == 1:
+            # Use optimized model for single-frame predictions
+            model_traj_train = TemporalModelOptimized1f(poses_valid_2d[0].shape[-2], poses_valid_2d[0].shape[-1], 1,
+                    filter_widths=filter_widths, causal=args.causal, dropout=args.dropout, 
+                    channels=args.channels)
+        else:
+            # When incompatible settings are detected (stride > 1, dense filters, or disabled optimization) fall back to normal model
+            model_traj_train = TemporalModel(poses_valid_2d[0].shape[-2], poses_valid_2d[0].shape[-1], 1,
                     filter_widths=filter_widths, causal=args.causal, dropout=args.dropout, 
                     channels=args.channels,
                     dense=args.dense)
@@ -235,6 +314,11 @@ if not args.evaluate:
         optimizer = optim.Adam(list(model_pos_train.parameters()) + list(model_traj_train.parameters()),
                                lr=lr, amsgrad=True)
         
+        # With --undistort the 2D targets have no lens distortion, so they
+        # are compared to a pinhole projection.
+        project_targets = project_to_2d_linear if args.undistort else project_to_2d
+        projection_func = project_to_2d_linear if args.linear_projection else project_targets
+
         losses_2d_train_unlabeled = []
         losses_2d_train_labeled_eval = []
         losses_2d_train_unlabeled_eval = []
@@ -263,7 +347,9 @@ if not args.evaluate:
                                        pad=pad, causal_shift=causal_shift, shuffle=True, 
                                        augment=args.data_augmentation,
                                        kps_left=kps_left, kps_right=kps_right, 
-                                       joints_left=joints_left, joints_right=joints_right)
+                                       joints_left=joints_left, joints_right=joints_right, prepad=True)
+    train_prefetcher = PrefetchGenerator(train_generator, num_workers=args.workers, queue_depth=args.prefetch,
+                                         processes=args.worker_processes)
 
     train_generator_eval = UnchunkedGenerator(cameras_train, poses_train, poses_train_2d,
                                               pad=pad, causal_shift=causal_shift, augment=False)
@@ -274,7 +360,10 @@ if not args.evaluate:
                                           poses_semi_2d, args.stride,
                                           pad=pad, causal_shift=causal_shift, shuffle=True,
                                           random_seed=4321, augment=args.data_augmentation,
-                                          kps_left=kps_left, kps_right=kps_right, joints_left=joints_left, joints_right=joints_right, endless=True)
+                                          kps_left=kps_left, kps_right=kps_right, joints_left=joints_left, joints_right=joints_right,
+                                          endless=True, prepad=True)
+        semi_prefetcher = PrefetchGenerator(semi_generator, num_workers=args.workers, queue_depth=args.prefetch,
+                                            processes=args.worker_processes, seed=4321)
 
         semi_generator_eval = UnchunkedGenerator(cameras_semi, None, poses_semi_2d,
                                                  pad=pad, causal_shift=causal_shift, augment=False)
@@ -310,14 +399,12 @@ if not args.evaluate:
         if semi_supervised:
             # Semi-supervised scenario
             model_traj_train.train()
-            for (_, batch_3d, batch_2d), (cam_semi, _, batch_2d_semi) in \
-                zip(train_generator.next_epoch(), semi_generator.next_epoch()):
+            for (_, inputs_3d, inputs_2d), (cam_semi, _, inputs_2d_semi) in \
+                zip(train_prefetcher.next_epoch(), semi_prefetcher.next_epoch()):
                 
                 # Fall back to supervised training for the first epoch (to avoid instability)
                 skip = epoch < args.warmup
                 
-                cam_semi = torch.from_numpy(cam_semi.astype('float32'))
-                inputs_3d = torch.from_numpy(batch_3d.astype('float32'))
                 if torch.cuda.is_available():
                     cam_semi = cam_semi.cuda()
                     inputs_3d = inputs_3d.cuda()
@@ -328,8 +415,6 @@ if not args.evaluate:
                 # Split point between labeled and unlabeled samples in the batch
                 split_idx = inputs_3d.shape[0]
 
-                inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
-                inputs_2d_semi = torch.from_numpy(batch_2d_semi.astype('float32'))
                 if torch.cuda.is_available():
                     inputs_2d = inputs_2d.cuda()
                     inputs_2d_semi = inputs_2d_semi.cuda()
@@ -360,7 +445,6 @@ if not args.evaluate:
                     else:
                         target_semi = inputs_2d_semi[:, :, :, :2].contiguous()
                         
-                    projection_func = project_to_2d_linear if args.linear_projection else project_to_2d
                     reconstruction_semi = projection_func(predicted_semi + predicted_traj_cat[split_idx:], cam_semi)
 
                     loss_reconstruction = mpjpe(reconstruction_semi, target_semi) # On 2D poses
@@ -388,9 +472,7 @@ if not args.evaluate:
             losses_2d_train_unlabeled.append(epoch_loss_2d_train_unlabeled / N_semi)
         else:
             # Regular supervised scenario
-            for _, batch_3d, batch_2d in train_generator.next_epoch():
-                inputs_3d = torch.from_numpy(batch_3d.astype('float32'))
-                inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
+            for _, inputs_3d, inputs_2d in train_prefetcher.next_epoch():
                 if torch.cuda.is_available():
                     inputs_3d = inputs_3d.cuda()
                     inputs_2d = inputs_2d.cuda()
@@ -429,8 +511,8 @@ if not args.evaluate:
             if not args.no_eval:
                 # Evaluate on test set
                 for cam, batch, batch_2d in test_generator.next_epoch():
-                    inputs_3d = torch.from_numpy(batch.astype('float32'))
-                    inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
+                    inputs_3d = torch.from_numpy(batch)
+                    inputs_2d = torch.from_numpy(batch_2d)
                     if torch.cuda.is_available():
                         inputs_3d = inputs_3d.cuda()
                         inputs_2d = inputs_2d.cuda()
@@ -438,17 +520,17 @@ if not args.evaluate:
                     inputs_3d[:, :, 0] = 0
 
                     # Predict 3D poses
-                    predicted_3d_pos = model_pos(inputs_2d)
+                    predicted_3d_pos = predict(model_pos, inputs_2d)
                     loss_3d_pos = mpjpe(predicted_3d_pos, inputs_3d)
                     epoch_loss_3d_valid += inputs_3d.shape[0]*inputs_3d.shape[1] * loss_3d_pos.item()
                     N += inputs_3d.shape[0]*inputs_3d.shape[1]
 
                     if semi_supervised:
-                        cam = torch.from_numpy(cam.astype('float32'))
+                        cam = torch.from_numpy(cam)
                         if torch.cuda.is_available():
                             cam = cam.cuda()
 
-                        predicted_traj = model_traj(inputs_2d)
+                        predicted_traj = predict(model_traj, inputs_2d)
                         loss_traj = mpjpe(predicted_traj, inputs_traj)
                         epoch_loss_traj_valid += inputs_traj.shape[0]*inputs_traj.shape[1] * loss_traj.item()
                         assert inputs_traj.shape[0]*inputs_traj.shape[1] == inputs_3d.shape[0]*inputs_3d.shape[1]
@@ -457,7 +539,7 @@ if not args.evaluate:
                             target = inputs_2d[:, pad:-pad, :, :2].contiguous()
                         else:
                             target = inputs_2d[:, :, :, :2].contiguous()
-                        reconstruction = project_to_2d(predicted_3d_pos + predicted_traj, cam)
+                        reconstruction = project_targets(predicted_3d_pos + predicted_traj, cam)
                         loss_reconstruction = mpjpe(reconstruction, target) # On 2D poses
                         epoch_loss_2d_valid += reconstruction.shape[0]*reconstruction.shape[1] * loss_reconstruction.item()
                         assert reconstruction.shape[0]*reconstruction.shape[1] == inputs_3d.shape[0]*inputs_3d.shape[1]
@@ -478,8 +560,8 @@ if not args.evaluate:
                         # This can only happen when downsampling the dataset
                         continue
                         
-                    inputs_3d = torch.from_numpy(batch.astype('float32'))
-                    inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
+                    inputs_3d = torch.from_numpy(batch)
+                    inputs_2d = torch.from_numpy(batch_2d)
                     if torch.cuda.is_available():
                         inputs_3d = inputs_3d.cuda()
                         inputs_2d = inputs_2d.cuda()
@@ -487,16 +569,16 @@ if not args.evaluate:
                     inputs_3d[:, :, 0] = 0
 
                     # Compute 3D poses
-                    predicted_3d_pos = model_pos(inputs_2d)
+                    predicted_3d_pos = predict(model_pos, inputs_2d)
                     loss_3d_pos = mpjpe(predicted_3d_pos, inputs_3d)
                     epoch_loss_3d_train_eval += inputs_3d.shape[0]*inputs_3d.shape[1] * loss_3d_pos.item()
                     N += inputs_3d.shape[0]*inputs_3d.shape[1]
 
                     if semi_supervised:
-                        cam = torch.from_numpy(cam.astype('float32'))
+                        cam = torch.from_numpy(cam)
                         if torch.cuda.is_available():
                             cam = cam.cuda()
-                        predicted_traj = model_traj(inputs_2d)
+                        predicted_traj = predict(model_traj, inputs_2d)
                         loss_traj = mpjpe(predicted_traj, inputs_traj)
                         epoch_loss_traj_train_eval += inputs_traj.shape[0]*inputs_traj.shape[1] * loss_traj.item()
                         assert inputs_traj.shape[0]*inputs_traj.shape[1] == inputs_3d.shape[0]*inputs_3d.shape[1]
@@ -505,7 +587,7 @@ if not args.evaluate:
                             target = inputs_2d[:, pad:-pad, :, :2].contiguous()
                         else:
                             target = inputs_2d[:, :, :, :2].contiguous()
-                        reconstruction = project_to_2d(predicted_3d_pos + predicted_traj, cam)
+                        reconstruction = project_targets(predicted_3d_pos + predicted_traj, cam)
                         loss_reconstruction = mpjpe(reconstruction, target)
                         epoch_loss_2d_train_labeled_eval += reconstruction.shape[0]*reconstruction.shape[1] * loss_reconstruction.item()
                         assert reconstruction.shape[0]*reconstruction.shape[1] == inputs_3d.shape[0]*inputs_3d.shape[1]
@@ -520,19 +602,19 @@ if not args.evaluate:
                 N_semi = 0
                 if semi_supervised:
                     for cam, _, batch_2d in semi_generator_eval.next_epoch():
-                        cam = torch.from_numpy(cam.astype('float32'))
-                        inputs_2d_semi = torch.from_numpy(batch_2d.astype('float32'))
+                        cam = torch.from_numpy(cam)
+                        inputs_2d_semi = torch.from_numpy(batch_2d)
                         if torch.cuda.is_available():
                             cam = cam.cuda()
                             inputs_2d_semi = inputs_2d_semi.cuda()
 
-                        predicted_3d_pos_semi = model_pos(inputs_2d_semi)
-                        predicted_traj_semi = model_traj(inputs_2d_semi)
+                        predicted_3d_pos_semi = predict(model_pos, inputs_2d_semi)
+                        predicted_traj_semi = predict(model_traj, inputs_2d_semi)
                         if pad > 0:
                             target_semi = inputs_2d_semi[:, pad:-pad, :, :2].contiguous()
                         else:
                             target_semi = inputs_2d_semi[:, :, :, :2].contiguous()
-                        reconstruction_semi = project_to_2d(predicted_3d_pos_semi + predicted_traj_semi, cam)
+                        reconstruction_semi = project_targets(predicted_3d_pos_semi + predicted_traj_semi, cam)
                         loss_reconstruction_semi = mpjpe(reconstruction_semi, target_semi)
 
                         epoch_loss_2d_train_unlabeled_eval += reconstruction_semi.shape[0]*reconstruction_semi.shape[1] \
@@ -643,75 +725,82 @@ if not args.evaluate:
 # Evaluate
 def evaluate(test_generator, action=None, 
              return_predictions=False, save_predictions=False, use_trajectory_model=False):
-    epoch_loss_3d_pos = 0
-    epoch_loss_3d_pos_procrustes = 0
-    epoch_loss_3d_pos_scale = 0
-    epoch_loss_3d_vel = 0
+    # Errors are summed on the device and only copied back at the end
+    accumulator = ErrorAccumulator()
     with torch.no_grad():
         if not use_trajectory_model:
             model_pos.eval()
         else:
             model_traj.eval()
-        N = 0
-        for _, batch, batch_2d in test_generator.next_epoch():
-            print(batch_2d.size)
-            inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
-            if torch.cuda.is_available():
-                inputs_2d = inputs_2d.cuda()
-
-            # Positional model
-            if not use_trajectory_model:
-                print(inputs_2d.size())
-                predicted_3d_pos = model_pos(inputs_2d)
-            else:
-                predicted_3d_pos = model_traj(inputs_2d)
+        packed = args.eval_pack_frames > 0 and not return_predictions and not save_predictions
+        if packed:
+            # Many sequences per forward pass, the errors are still summed sequence by sequence
+            model = model_traj if use_trajectory_model else model_pos
+            for indices, _, batch, batch_2d, mask in test_generator.next_packed_epoch(args.eval_pack_frames):
+                inputs_2d = torch.from_numpy(batch_2d)
+                if torch.cuda.is_available():
+                    inputs_2d = inputs_2d.cuda()
+                predicted_3d_pos = predict(model, inputs_2d)
+
+                n = len(indices)
+                if test_generator.augment_enabled():
+                    # Undo flipping and take average with non-flipped version
+                    predicted_3d_pos[n:, :, :, 0] *= -1
+                    if not use_trajectory_model:
+                        predicted_3d_pos[n:, :, joints_left + joints_right] = predicted_3d_pos[n:, :, joints_right + joints_left]
+                    predicted_3d_pos = (predicted_3d_pos[:n] + predicted_3d_pos[n:]) / 2
+
+                inputs_3d = torch.from_numpy(batch[:n])
+                if torch.cuda.is_available():
+                    inputs_3d = inputs_3d.cuda()
+                inputs_3d[:, :, 0] = 0
+                for i, length in enumerate(mask[:n].sum(axis=1)):
+                    accumulator.add(predicted_3d_pos[i, :length], inputs_3d[i, :length], action)
+        else:
+            for _, batch, batch_2d in test_generator.next_epoch():
+                print(batch_2d.size)
+                inputs_2d = torch.from_numpy(batch_2d)
+                if torch.cuda.is_available():
+                    inputs_2d = inputs_2d.cuda()
 
-            # Test-time augmentation (if enabled)
-            if test_generator.augment_enabled():
-                # Undo flipping and take average with non-flipped version
-                print(predicted_3d_pos.size())
-                predicted_3d_pos[1, :, :, 0] *= -1
+                # Positional model
                 if not use_trajectory_model:
-                    predicted_3d_pos[1, :, joints_left + joints_right] = predicted_3d_pos[1, :, joints_right + joints_left]
-                predicted_3d_pos = torch.mean(predicted_3d_pos, dim=0, keepdim=True)
-
-            if save_predictions:
-                print(predicted_3d_pos.size())
-                predictions = predicted_3d_pos.cpu().numpy()
-                print(predictions.shape)
-                np.save('model_predictions', predictions)
-            if return_predictions:
-                return predicted_3d_pos.squeeze(0).cpu().numpy()
+                    print(inputs_2d.size())
+                    predicted_3d_pos = predict(model_pos, inputs_2d)
+                else:
+                    predicted_3d_pos = predict(model_traj, inputs_2d)
+
+                # Test-time augmentation (if enabled)
+                if test_generator.augment_enabled():
+                    # Undo flipping and take average with non-flipped version
+                    print(predicted_3d_pos.size())
+                    predicted_3d_pos[1, :, :, 0] *= -1
+                    if not use_trajectory_model:
+                        predicted_3d_pos[1, :, joints_left + joints_right] = predicted_3d_pos[1, :, joints_right + joints_left]
+                    predicted_3d_pos = torch.mean(predicted_3d_pos, dim=0, keepdim=True)
+
+                if save_predictions:
+                    print(predicted_3d_pos.size())
+                    predictions = predicted_3d_pos.cpu().numpy()
+                    print(predictions.shape)
+                    np.save('model_predictions', predictions)
+                if return_predictions:
+                    return predicted_3d_pos.squeeze(0).cpu().numpy()
                 
-            inputs_3d = torch.from_numpy(batch.astype('float32'))
-            if torch.cuda.is_available():
-                inputs_3d = inputs_3d.cuda()
-            inputs_3d[:, :, 0] = 0    
-            if test_generator.augment_enabled():
-                inputs_3d = inputs_3d[:1]
-
-            error = mpjpe(predicted_3d_pos, inputs_3d)
-            epoch_loss_3d_pos_scale += inputs_3d.shape[0]*inputs_3d.shape[1] * n_mpjpe(predicted_3d_pos, inputs_3d).item()
-
-            epoch_loss_3d_pos += inputs_3d.shape[0]*inputs_3d.shape[1] * error.item()
-            N += inputs_3d.shape[0] * inputs_3d.shape[1]
-            
-            inputs = inputs_3d.cpu().numpy().reshape(-1, inputs_3d.shape[-2], inputs_3d.shape[-1])
-            predicted_3d_pos = predicted_3d_pos.cpu().numpy().reshape(-1, inputs_3d.shape[-2], inputs_3d.shape[-1])
-
-            epoch_loss_3d_pos_procrustes += inputs_3d.shape[0]*inputs_3d.shape[1] * p_mpjpe(predicted_3d_pos, inputs)
+                inputs_3d = torch.from_numpy(batch)
+                if torch.cuda.is_available():
+                    inputs_3d = inputs_3d.cuda()
+                inputs_3d[:, :, 0] = 0    
+                if test_generator.augment_enabled():
+                    inputs_3d = inputs_3d[:1]
 
-            # Compute velocity error
-            epoch_loss_3d_vel += inputs_3d.shape[0]*inputs_3d.shape[1] * mean_velocity_error(predicted_3d_pos, inputs)
+                accumulator.add(predicted_3d_pos[0], inputs_3d[0], action)
             
     if action is None:
         print('----------')
     else:
         print('----'+action+'----')
-    e1 = (epoch_loss_3d_pos / N)*1000
-    e2 = (epoch_loss_3d_pos_procrustes / N)*1000
-    e3 = (epoch_loss_3d_pos_scale / N)*1000
-    ev = (epoch_loss_3d_vel / N)*1000
+    e1, e2, e3, ev = accumulator.errors(action) * 1000
     print('Test time augmentation:', test_generator.augment_enabled())
     print('Protocol #1 Error (MPJPE):', e1, 'mm')
     print('Protocol #2 Error (P-MPJPE):', e2, 'mm')